@@ -0,0 +1,417 @@
+""" Micro-benchmarks for the s8bl library.
+Run as: python benchmark.py [name ...]
+"""
+
+import contextlib
+import difflib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dump_Meka
+from s8bl.romhash import mapped_rom, rom_keys, crc32_buffer, detect_overdump
+from s8bl.binfmt import countries_mask
+from s8bl.columns import library_columns
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, S8BL_SaveProfiles, S8BL_Country, S8BL_Flag, \
+    S8BL_Flag_Names, S8BL_Mapper, S8BL_NameIndex, S8BL_System, normalize_title, snapshot_path
+
+MERGED_DB = 's8bl2_meka_totalsms.json'
+
+
+def timed(fn, *args, repeat: int = 5):
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def peak_memory(fn, *args):
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def make_rom_file(size: int) -> str:
+    fd, path = tempfile.mkstemp(suffix='.sms')
+    with os.fdopen(fd, 'wb') as outfile:
+        # 512-byte copier header in front of a 2x overdump, the worst case for the fallback path
+        half = os.urandom(size // 2)
+        outfile.write(os.urandom(512) + half + half)
+    return path
+
+
+def bench_mmap_hashing():
+    def with_read(path):
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        return crc32_buffer(data), rom_keys(data)
+
+    def with_mmap(path):
+        with mapped_rom(path) as mv:
+            return crc32_buffer(mv), rom_keys(mv)
+
+    for size in (1 << 20, 4 << 20, 8 << 20):
+        path = make_rom_file(size)
+        try:
+            t_read, r_read = timed(with_read, path)
+            t_mmap, r_mmap = timed(with_mmap, path)
+            m_read = peak_memory(with_read, path)[0]
+            m_mmap = peak_memory(with_mmap, path)[0]
+            assert r_read == r_mmap
+            print('mmap_hashing %5d KB: read() %7.2f ms peak %8d KB | mmap %7.2f ms peak %8d KB' % (
+                size // 1024, t_read * 1000, m_read // 1024, t_mmap * 1000, m_mmap // 1024))
+        finally:
+            os.unlink(path)
+
+
+def bench_overdump():
+    def with_bytes(data):
+        # The straightforward version: slice copies, halves only
+        size = len(data)
+        while size % 2 == 0 and data[:size // 2] == data[size // 2:size]:
+            size //= 2
+        return size
+
+    def with_byte_views(data):
+        mv = memoryview(data)
+        size = len(mv)
+        while size % 2 == 0 and mv[:size // 2] == mv[size // 2:size]:
+            size //= 2
+        return size
+
+    for size in (2 << 20, 4 << 20, 8 << 20):
+        quarter = os.urandom(size // 4)
+        for label, data in (('4x', quarter * 4), ('1x', os.urandom(size))):
+            t_bytes, r_bytes = timed(with_bytes, data)
+            t_views, r_views = timed(with_byte_views, data)
+            t_detect, r_detect = timed(detect_overdump, data)
+            m_bytes = peak_memory(with_bytes, data)[0]
+            m_detect = peak_memory(detect_overdump, data)[0]
+            assert r_bytes == r_views == r_detect[0]
+            print('overdump %5d KB %s: bytes %6.2f ms peak %6d KB | byte views %6.2f ms | '
+                  'detect_overdump %6.2f ms peak %3d KB' % (
+                      size // 1024, label, t_bytes * 1000, m_bytes // 1024, t_views * 1000,
+                      t_detect * 1000, m_detect // 1024))
+
+
+def bench_lazy_load():
+    # Startup plus the one or two lookups a CLI invocation does
+    with open(MERGED_DB) as infile:
+        crcs = [e['CRC32'] for e in json.load(infile)[:2]]
+
+    def startup(lazy):
+        lib = S8BL_Library()
+        lib.load(MERGED_DB, lazy=lazy)
+        return [lib.CRC_to_db.get(crc).names[0] for crc in crcs]
+
+    t_eager, r_eager = timed(startup, False)
+    t_lazy, r_lazy = timed(startup, True)
+    m_eager = peak_memory(startup, False)[0]
+    m_lazy = peak_memory(startup, True)[0]
+    assert r_eager == r_lazy
+    print('lazy_load %s: eager %6.2f ms peak %6d KB | lazy %6.2f ms peak %6d KB' % (
+        MERGED_DB, t_eager * 1000, m_eager // 1024, t_lazy * 1000, m_lazy // 1024))
+
+
+def bench_profiles():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    tdir = tempfile.mkdtemp()
+    try:
+        for profile in S8BL_SaveProfiles:
+            path = os.path.join(tdir, 'db.' + profile)
+            t_save = timed(lib.save, path, profile, repeat=3)[0]
+            t_load = timed(S8BL_Library().load, path, repeat=3)[0]
+            print('profiles %-8s %8d bytes | save %7.2f ms | load %7.2f ms' % (
+                profile, os.path.getsize(path), t_save * 1000, t_load * 1000))
+            os.unlink(path)
+    finally:
+        os.rmdir(tdir)
+
+
+def bench_snapshot():
+    tdir = tempfile.mkdtemp()
+    path = os.path.join(tdir, 'db.json')
+    try:
+        with open(MERGED_DB) as infile, open(path, 'w') as outfile:
+            outfile.write(infile.read())
+        t_json = timed(S8BL_Library().load, path)[0]
+        t_cold = timed(S8BL_Library().load, path, False, True, repeat=1)[0]
+        t_warm = timed(S8BL_Library().load, path, False, True)[0]
+        print('snapshot %s: json %6.2f ms | cold snapshot %6.2f ms | warm snapshot %6.2f ms (%d bytes)' % (
+            MERGED_DB, t_json * 1000, t_cold * 1000, t_warm * 1000, os.path.getsize(snapshot_path(path))))
+    finally:
+        for p in (path, snapshot_path(path)):
+            if os.path.exists(p):
+                os.unlink(p)
+        os.rmdir(tdir)
+
+
+def bench_entries():
+    with open(MERGED_DB) as infile:
+        indata = json.load(infile)
+    count = len(indata)
+
+    def build():
+        lib = S8BL_Library()
+        lib.fromPyDictTotal(indata)
+        return lib
+
+    def merge(pair):
+        # Every incoming entry hits an existing CRC32 and goes through the per-member merge
+        lib, other = pair
+        with contextlib.redirect_stdout(io.StringIO()):
+            for entry in other.db:
+                lib.merge_in(entry)
+
+    def to_dicts(lib):
+        return [entry.toPyDict() for entry in lib.db]
+
+    m_build = peak_memory(build)[0]
+    t_merge = timed(merge, (build(), build()), repeat=3)[0]
+    lib = build()
+    t_dicts = timed(to_dicts, lib)[0]
+    tdir = tempfile.mkdtemp()
+    path = os.path.join(tdir, 'db.json')
+    try:
+        t_save = timed(lib.save, path, repeat=3)[0]
+        os.unlink(path)
+    finally:
+        os.rmdir(tdir)
+    print('entries %s (%d): %4d bytes/entry | merge_in %7d entries/s | toPyDict %7d entries/s | '
+          'save %7d entries/s' % (MERGED_DB, count, m_build // count, count / t_merge, count / t_dicts,
+                                  count / t_save))
+
+
+def bench_columns():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    us = 1 << S8BL_Country['US']
+
+    def with_objects():
+        # The report queries as loops over the entries
+        sizes = {}
+        mappers = {}
+        flags = dict.fromkeys(S8BL_Flag_Names, 0)
+        for e in lib.db:
+            sizes.setdefault(e.system or 0, []).append(e.ROM_size or 0)
+            if countries_mask(e) & us:
+                mappers[e.mapper or 0] = mappers.get(e.mapper or 0, 0) + 1
+            for nm in S8BL_Flag_Names:
+                if getattr(e.flags, nm):
+                    flags[nm] += 1
+        return sizes, dict(sorted(mappers.items())), flags
+
+    def with_columns(cols):
+        return (cols.group_by('system', 'ROM_size'), cols.group_count('mapper', cols.select(countries='US')),
+                cols.flag_counts())
+
+    def build():
+        lib.columns_cache = None
+        return library_columns(lib)
+
+    t_build, cols = timed(build)
+    t_objects, r_objects = timed(with_objects)
+    t_columns, r_columns = timed(with_columns, cols)
+    assert r_objects[1:] == r_columns[1:]
+    print('columns %s (%s backend): objects %6.2f ms | build %6.2f ms | columns %6.2f ms' % (
+        MERGED_DB, 'numpy' if cols.numpy else 'array', t_objects * 1000, t_build * 1000, t_columns * 1000))
+
+
+def bench_query():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    gg, sg1000, dahjee = S8BL_System['gg'], S8BL_System['sg1000'], S8BL_Mapper['dahjee_a']
+
+    def with_scan():
+        return ([e for e in lib.db if e.system == gg and e.flags.gg_sms_mode],
+                [e for e in lib.db if e.system == sg1000 and e.mapper == dahjee])
+
+    def with_query():
+        return (list(lib.query(system='gg', flags=S8BL_Flag.gg_sms_mode)),
+                list(lib.query(system='sg1000', mapper='dahjee_a')))
+
+    t_scan, r_scan = timed(with_scan)
+    t_query, r_query = timed(with_query)
+    assert r_scan == r_query
+    print('query %s: list comprehension %6.3f ms | query() %6.3f ms' % (MERGED_DB, t_scan * 1000, t_query * 1000))
+
+
+def bench_search():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    queries = ('alex kid miracle', 'sonic hedgehog 2', 'phantsy star', 'wonderboy monster land')
+
+    def build():
+        lib.name_search = None
+        return lib.search_names('')
+
+    def with_difflib(query):
+        # Naive fuzzy scan: SequenceMatcher ratio against every name
+        q = query.casefold()
+        return max((difflib.SequenceMatcher(None, q, nm.casefold()).ratio(), nm)
+                   for e in lib.db for nm in S8BL_NameIndex.entry_names(e))[1]
+
+    t_build = timed(build, repeat=3)[0]
+    for query in queries:
+        t_scan, r_scan = timed(with_difflib, query, repeat=1)
+        t_index, r_index = timed(lib.search_names, query)
+        print('search %-24s: difflib scan %7.2f ms (%s) | trigram index %5.2f ms (%s)' % (
+            query, t_scan * 1000, r_scan, t_index * 1000, r_index[0].name if r_index else None))
+    print('search index build %6.2f ms, %d names, %d trigrams' % (
+        t_build * 1000, len(lib.name_search.names), len(lib.name_search.trigram_to_names)))
+
+
+def bench_titles():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    crcless = [e.names[0] for e in lib.db if e.CRC32 == 0 and len(e.names) > 0]
+
+    def with_scan():
+        # Linear scan per name, normalizing every name of every entry each time
+        out = []
+        for name in crcless[:20]:
+            title = normalize_title(name)
+            out.append([e for e in lib.db if any(normalize_title(nm) == title for nm in S8BL_NameIndex.entry_names(e))])
+        return out
+
+    def build():
+        lib.title_to_db = None
+        return lib.find_by_title('')
+
+    def with_index():
+        return [lib.find_by_title(name) for name in crcless]
+
+    t_scan, r_scan = timed(with_scan, repeat=1)
+    t_build = timed(build, repeat=3)[0]
+    t_index, r_index = timed(with_index)
+    assert r_scan == r_index[:20]
+    print('titles %s: scan %7.2f ms/name | index build %6.2f ms, %d titles | indexed %6.3f ms/name' % (
+        MERGED_DB, t_scan * 1000 / 20, t_build * 1000, len(lib.title_to_db), t_index * 1000 / len(crcless)))
+
+
+def bench_meka_merge():
+    # dump_Meka.py's merge of meka.nam into s8bl.json, timing merge_in only
+    with open('s8bl.json') as infile:
+        indata = json.load(infile)
+    with open('meka.nam') as infile:
+        lines = infile.readlines()
+    best = None
+    conflicts = 0
+    for i in range(3):
+        lib = S8BL_Library()
+        lib.fromPyDictTotal(indata)
+        entries = [e for e in (dump_Meka.parse_line(line) for line in lines) if e is not None]
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            results = [lib.merge_in(e) for e in entries]
+            elapsed = time.perf_counter() - start
+        conflicts = sum(len(r) for r in results if r)
+        if best is None or elapsed < best:
+            best = elapsed
+    print('meka_merge %d entries: merge_in %7.2f ms (%6.2f us/entry) | %d conflicts' % (
+        len(entries), best * 1000, best * 1e6 / len(entries), conflicts))
+
+
+def bench_merge_library():
+    # meka.nam as a second library merged in bulk, against merge_in entry by entry.
+    # Both start with the search index built and search once afterwards, merge_library rebuilds it then.
+    # merge_library copies the entries of a library, so the merge_in loop merges copies as well
+    with open('s8bl.json') as infile:
+        indata = json.load(infile)
+    with open('meka.nam') as infile:
+        lines = infile.readlines()
+    best_in = best_bulk = None
+    same = True
+    for i in range(3):
+        seq = S8BL_Library()
+        seq.fromPyDictTotal(indata)
+        seq.search_names('alex kidd')
+        entries = [e for e in (dump_Meka.parse_line(line) for line in lines) if e is not None]
+        start = time.perf_counter()
+        for e in entries:
+            seq.merge_in(e.copy())
+        seq.search_names('alex kidd')
+        elapsed_in = time.perf_counter() - start
+
+        bulk = S8BL_Library()
+        bulk.fromPyDictTotal(indata)
+        bulk.search_names('alex kidd')
+        other = S8BL_Library()
+        other.db = [e for e in (dump_Meka.parse_line(line) for line in lines) if e is not None]
+        start = time.perf_counter()
+        bulk.merge_library(other)
+        bulk.search_names('alex kidd')
+        elapsed_bulk = time.perf_counter() - start
+        same = same and seq.toPyDict() == bulk.toPyDict()
+        if best_in is None or elapsed_in < best_in:
+            best_in = elapsed_in
+        if best_bulk is None or elapsed_bulk < best_bulk:
+            best_bulk = elapsed_bulk
+    print('merge_library %d entries: merge_in loop %7.2f ms | merge_library %7.2f ms (%.2fx) | same result: %s' % (
+        len(entries), best_in * 1000, best_bulk * 1000, best_in / best_bulk, same))
+
+
+def bench_meka_fields():
+    # parse_new_fields / parse_old_fields over every field of meka.nam, lines split beforehand.
+    # One pass, as a build makes: nothing is cached between fields
+    with open('meka.nam') as infile:
+        lines = [line.strip() for line in infile]
+    calls = []
+    for line in lines:
+        if len(line) < 1 or line[:1] == ';' or line[:2] == '--':
+            continue
+        if dump_Meka.line_system(line) is not None:
+            calls.append((dump_Meka.parse_new_fields, dump_Meka.new_fields(line)[1:]))
+        else:
+            calls.append((dump_Meka.parse_old_fields, dump_Meka.old_fields(line)[1:]))
+    fields = sum(len(f) for parse, f in calls)
+    entries = [S8BL_LibraryEntry() for c in calls]
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for entry, (parse, f) in zip(entries, calls):
+            parse(entry, f)
+        elapsed = time.perf_counter() - start
+    print('meka_fields %d lines, %d fields: one pass %7.2f ms (%4.0f ns/field)' % (
+        len(calls), fields, elapsed * 1000, elapsed * 1e9 / fields))
+
+
+BENCHMARKS = {
+    'mmap_hashing': bench_mmap_hashing,
+    'overdump': bench_overdump,
+    'lazy_load': bench_lazy_load,
+    'profiles': bench_profiles,
+    'snapshot': bench_snapshot,
+    'entries': bench_entries,
+    'columns': bench_columns,
+    'query': bench_query,
+    'search': bench_search,
+    'titles': bench_titles,
+    'meka_merge': bench_meka_merge,
+    'merge_library': bench_merge_library,
+    'meka_fields': bench_meka_fields,
+}
+
+
+def main(names):
+    if len(names) == 0:
+        names = list(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,31 @@
+""" Builds s8bl2_meka_totalsms.json from s8bl.json, TotalJustice's list and meka.nam in one run,
+rather than dump_TotalJustice.py then dump_Meka.py each loading and saving a whole database.
+Both sources are parsed on a worker pool while s8bl.json loads, s8bl.json itself is left untouched.
+"""
+
+import sys
+
+import dump_Meka
+import dump_TotalJustice
+from s8bl.importer import S8BL_Source, run_import
+
+SOURCES = [
+    S8BL_Source('TotalJustice', dump_TotalJustice.parse_entries, dump_TotalJustice.to_parse,
+                dump_TotalJustice.TJ_MERGE_RULES),
+    S8BL_Source('meka', dump_Meka.parse_file, 'meka.nam'),
+]
+
+
+def main(args):
+    out_path = args[0] if len(args) > 0 else 's8bl2_meka_totalsms.json'
+    report = run_import(SOURCES, 's8bl.json', out_path)
+    for name, conflicts in report.conflicts.items():
+        for conflict in conflicts:
+            print('CONFLICT', name, conflict.member, conflict.current, conflict.incoming, conflict.entry.names)
+    for stage, seconds in report.timings.items():
+        print('%-20s %8.2f ms' % (stage, seconds * 1000))
+    print(report.summary())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,11 @@
 import re
 import os
-from typing import List
+from typing import List, Dict, Iterator, Optional, Tuple, Callable
 
-from s8bl.s8bl import S8BL_LibraryEntry, S8BL_Library, S8BL_System, S8BL_Mapper
+from s8bl.s8bl import S8BL_LibraryEntry, S8BL_Library, S8BL_System, S8BL_Mapper, S8BL_Flag_Names, \
+    detect_profile, open_profile
+
+NAM_ENCODING = 'utf-8'
 
 MEKA_MAPPER_TO_OURS = {
     0: S8BL_Mapper['sega'],
@@ -29,109 +32,186 @@ MEKA_MAPPER_TO_OURS = {
 }
 
 
-def parse_old_fields(entry: S8BL_LibraryEntry, fields: List[str]):
-    for field in fields:
-        if field == 'BAD':
-            entry.flags.bad = True
-        elif field == 'HACK':
-            entry.flags.hacks = True
-        elif field[:8] == 'AUTHORS=':
-            if entry.misc is None:
-                entry.misc = {}
-            entry.misc['authors'] = field[8:]
-        elif field[:8] == 'COMMENT=':
-            entry.comments = [field[8:]]
-        elif field[:6] == 'TRANS=':
-            entry.translation = field[6:]
-        elif field[:4] == 'VER=':
-            entry.version = field[4:]
-        elif field == 'PROTO':
-            entry.flags.prototype = True
-        elif field == 'TVTYPE=PAL/SECAM':
-            entry.requires_pal = True
-        elif 'ID=' in field:
-            entry.identifier = field[3:]
-        elif 'DATE=' in field:
-            entry.date = field[:5]
-        elif 'JAPNAME=' in field:
-            if entry.alt_names is None:
-                entry.alt_names = []
-            entry.alt_names.append(field[8:])
-        elif 'Mapper=' in field or 'MAPPER=' in field:
-            entry.mapper = MEKA_MAPPER_TO_OURS[int(field[7:])]
-        elif field == 'FLICKER':
-            entry.flags.sprite_flicker = True
-        else:
-            print('UNKNOWN FIELD?', field)
-
-
-def parse_new_fields(entry: S8BL_LibraryEntry, fields: List[str]):
-    for field in fields:
-        field = field.strip()
-        if ';' in field:
-            pp = field.index(';')
-            field = field[:pp].strip()
-        if field[:8] == 'COUNTRY=':
-            if entry.countries is None:
-                entry.countries = []
-            entry.countries.append(field[8:])
-        elif field[:11] == 'EMU_MAPPER=':
-            entry.mapper = MEKA_MAPPER_TO_OURS[int(field[11:])]
-        elif field[:11] == 'PRODUCT_NO=':
-            entry.product_number = field[11:]
-        elif field[:8] == 'COMMENT=':
-            entry.comments = [field[8:]]
-        elif field[:8] == 'VERSION=':
-            entry.version = field[8:]
-        elif field[:6] == 'FLAGS=':
-            entry.flags.parse_meka(field[6:])
-        elif field[:18] == 'EMU_SPRITE_FLICKER':
-            entry.flags.sprite_flicker = True
-        elif field[:6] == 'TRANS=':
-            entry.translation = field[6:]
-        elif field[:8] == 'AUTHORS=':
-            if entry.misc is None:
-                entry.misc = {}
-            entry.misc['authors'] = field[8:]
-        elif field[:5] == 'NAME_':
-            if entry.alt_names is None:
-                entry.alt_names = []
-            entry.alt_names.append(field[5:])
-        elif field == 'EMU_3D':
-            entry.flags.is_3d = True
-        elif field == 'EMU_TVTYPE=PAL':
-            entry.requires_pal = True
-        elif field == 'EMU_TVTYPE=NTSC':
-            entry.requires_ntsc = True
-        elif field == 'EMU_VDP=315-5124':
-            entry.flags.needs_vdp1 = True
-        elif 'EMU_COUNTRY=' in field:
-            pass
-        elif field[:12] == 'EMU_IPERIOD=':
-            pass
-        elif field[:11] == 'EMU_INPUTS=':
-            if entry.inputs is None:
-                entry.inputs = []
-            entry.inputs.append(field[11:22].lower())
-        elif field[:12] == 'EMU_LP_FUNC=':
-            if entry.misc is None:
-                entry.misc = {}
-            a = int(field[12:])
-            if a == 1:
-                entry.misc['lp_func'] = 'missile_defense_3d'
-            elif a == 2:
-                entry.misc['lp_func'] = '3dgunner'
+MEKA_LP_FUNCS = {
+    1: 'missile_defense_3d',
+    2: '3dgunner',
+}
+
+
+# Field actions: what a KEY does with its value
+FIELD_SET = 0  # entry.<target> = value
+FIELD_APPEND = 1  # value appended to the entry.<target> list
+FIELD_FLAG = 2  # entry.flags.<target> = True, for bare keys
+FIELD_CALL = 3  # target(entry, value), returning False rejects the field
+FIELD_IGNORE = 4
+FIELD_LIST = 5  # entry.<target> = [value]
+
+
+def _meka_mapper(value: str) -> int:
+    return MEKA_MAPPER_TO_OURS[int(value)]
+
+
+def _lp_func(entry: S8BL_LibraryEntry, value: str) -> None:
+    if entry.misc is None:
+        entry.misc = {}
+    entry.misc['lp_func'] = MEKA_LP_FUNCS.get(int(value), value)
+
+
+def _authors(entry: S8BL_LibraryEntry, value: str) -> None:
+    if entry.misc is None:
+        entry.misc = {}
+    entry.misc['authors'] = value
+
+
+def _choice(choices: Dict[str, tuple]):
+    # value -> (member or flag name, value to set), other values are rejected
+    def handler(entry: S8BL_LibraryEntry, value: str):
+        if value not in choices:
+            return False
+        member, to = choices[value]
+        setattr(entry.flags if member in S8BL_Flag_Names else entry, member, to)
+    return handler
+
+
+class MekaFields:
+    # Field table of one meka.nam format. values and bare map KEY=VALUE keys and bare KEYs to
+    # (action, target, convert) rows, convert being applied to the value first when not None.
+    # prefixes are (KEY prefix, row) tried when no KEY=VALUE key matches, the value is then the field
+    # minus the prefix. comments strips fields and drops anything after a ;
+    # reject(field, fields) is called with every (cleaned) field nothing took
+    def __init__(self, values: Dict[str, tuple], bare: Dict[str, tuple], prefixes=(), comments: bool = False,
+                 reject: Optional[Callable] = None):
+        self.values: Dict[str, tuple] = values
+        self.bare: Dict[str, tuple] = bare
+        self.prefixes: tuple = tuple(prefixes)
+        self.comments: bool = comments
+        self.reject: Optional[Callable] = reject
+
+    def decode(self, entry: S8BL_LibraryEntry, fields: List[str]) -> None:
+        # Applies every field to entry: one partition and one dict lookup per field,
+        # prefixes are only tried for unknown keys
+        values = self.values
+        comments = self.comments
+        for field in fields:
+            if comments:
+                field = field.strip()
+                if ';' in field:
+                    field = field[:field.index(';')].strip()
+            key, sep, value = field.partition('=')
+            if sep:
+                row = values.get(key)
+                if row is None:
+                    for prefix, row in self.prefixes:
+                        if key.startswith(prefix):
+                            value = field[len(prefix):]
+                            break
+                    else:
+                        self._reject(field, fields)
+                        continue
             else:
-                entry.misc['lp_func'] = field[12:]
-        else:
-            if 'B based on the fact that' in field:
-                continue
-            print('INVALID FIELD?', field, fields)
-            pass
+                row = self.bare.get(key)
+                if row is None:
+                    self._reject(field, fields)
+                    continue
+            action, target, convert = row
+            if convert is not None:
+                value = convert(value)
+            if action == FIELD_APPEND:
+                items = getattr(entry, target)
+                if items is None:
+                    setattr(entry, target, [value])
+                else:
+                    items.append(value)
+            elif action == FIELD_SET:
+                setattr(entry, target, value)
+            elif action == FIELD_LIST:
+                setattr(entry, target, [value])
+            elif action == FIELD_FLAG:
+                setattr(entry.flags, target, True)
+            elif action == FIELD_CALL:
+                if target(entry, value) is False:
+                    self._reject(field, fields)
+
+    def _reject(self, field: str, fields: List[str]) -> None:
+        if self.reject is not None:
+            self.reject(field, fields)
+
+
+def _unknown_old_field(field: str, fields: List[str]) -> None:
+    print('UNKNOWN FIELD?', field)
+
+
+def _invalid_new_field(field: str, fields: List[str]) -> None:
+    if 'B based on the fact that' in field:
+        return
+    print('INVALID FIELD?', field, fields)
+
+
+MEKA_OLD_FIELDS = MekaFields({
+    'AUTHORS': (FIELD_CALL, _authors, None),
+    'COMMENT': (FIELD_LIST, 'comments', None),
+    'TRANS': (FIELD_SET, 'translation', None),
+    'VER': (FIELD_SET, 'version', None),
+    'TVTYPE': (FIELD_CALL, _choice({'PAL/SECAM': ('requires_pal', True)}), None),
+    'ID': (FIELD_SET, 'identifier', None),
+    'DATE': (FIELD_SET, 'date', None),
+    'JAPNAME': (FIELD_APPEND, 'alt_names', None),
+    'MAPPER': (FIELD_SET, 'mapper', _meka_mapper),
+    'Mapper': (FIELD_SET, 'mapper', _meka_mapper),
+}, {
+    'BAD': (FIELD_FLAG, 'bad', None),
+    'HACK': (FIELD_FLAG, 'hacks', None),
+    'PROTO': (FIELD_FLAG, 'prototype', None),
+    'FLICKER': (FIELD_FLAG, 'sprite_flicker', None),
+}, reject=_unknown_old_field)
+MEKA_NEW_FIELDS = MekaFields({
+    'COUNTRY': (FIELD_APPEND, 'countries', None),
+    'EMU_MAPPER': (FIELD_SET, 'mapper', _meka_mapper),
+    'PRODUCT_NO': (FIELD_SET, 'product_number', None),
+    'COMMENT': (FIELD_LIST, 'comments', None),
+    'VERSION': (FIELD_SET, 'version', None),
+    'FLAGS': (FIELD_CALL, lambda entry, value: entry.flags.parse_meka(value), None),
+    'TRANS': (FIELD_SET, 'translation', None),
+    'AUTHORS': (FIELD_CALL, _authors, None),
+    'EMU_TVTYPE': (FIELD_CALL, _choice({'PAL': ('requires_pal', True), 'NTSC': ('requires_ntsc', True)}), None),
+    'EMU_VDP': (FIELD_CALL, _choice({'315-5124': ('needs_vdp1', True)}), None),
+    'EMU_COUNTRY': (FIELD_IGNORE, None, None),
+    'EMU_IPERIOD': (FIELD_IGNORE, None, None),
+    'EMU_INPUTS': (FIELD_APPEND, 'inputs', lambda value: value[:11].lower()),
+    'EMU_LP_FUNC': (FIELD_CALL, _lp_func, None),
+}, {
+    'EMU_SPRITE_FLICKER': (FIELD_FLAG, 'sprite_flicker', None),
+    'EMU_3D': (FIELD_FLAG, 'is_3d', None),
+}, (
+    # NAME_<country>=name is kept with its country, as '<country>=name'
+    ('NAME_', (FIELD_APPEND, 'alt_names', None)),
+), comments=True, reject=_invalid_new_field)
+
+
+# parse_*_fields(entry, fields) apply the fields after a line's name to entry
+parse_old_fields = MEKA_OLD_FIELDS.decode
+parse_new_fields = MEKA_NEW_FIELDS.decode
+
+
+def new_fields(line: str) -> List[str]:
+    # Name then fields of a new format line, / separated
+    rol = line[32:]
+    rol = rol.replace('\\/', '|')
+    return rol.split('/')
+
+
+def old_fields(line: str) -> List[str]:
+    # Name then fields of an old format line, , separated
+    rol = line[17:]
+    rol = rol.replace('\\,', '|')
+    fields = rol.split(',')
+    for i in range(0, len(fields)):
+        fields[i] = fields[i].replace('|', ',')
+    return fields
 
 
 # Parse Meka new format
-def parse_new(lib: S8BL_Library, kind: int, line: str):
+def parse_new(kind: int, line: str):
     # print(line)
     crc = line[4:12].strip()
     if len(crc) < 8:
@@ -139,9 +219,7 @@ def parse_new(lib: S8BL_Library, kind: int, line: str):
         return
     crc = int(crc, 16)
     mekacrc = line[13:29]
-    rol = line[32:]
-    rol = rol.replace('\\/', '|')
-    fields = rol.split('/')
+    fields = new_fields(line)
     fields[0].replace('|', '/')
     entry = S8BL_LibraryEntry()
     entry.CRC32 = crc
@@ -154,54 +232,93 @@ def parse_new(lib: S8BL_Library, kind: int, line: str):
     return entry
 
 
-def parse_old(lib: S8BL_Library, line: str):
+def parse_old(line: str):
     entry = S8BL_LibraryEntry()
     entry.MekaCRC = line[:16]
-    rol = line[17:]
-    rol = rol.replace('\\,', '|')
-    fields = rol.split(',')
-    for i in range(0, len(fields)):
-        fields[i] = fields[i].replace('|', ',')
+    fields = old_fields(line)
     entry.names = [fields[0]]
     if len(fields) > 1:
         parse_old_fields(entry, fields[1:])
     return entry
 
 
+def line_system(line: str) -> Optional[int]:
+    # System of a new format line, None for the old format
+    kind = None
+    if line[:2] == 'GG':
+        kind = S8BL_System['gg']
+    elif line[:3] == 'SG1':
+        kind = S8BL_System['sg1000']
+    elif line[:3] == 'SC3':
+        kind = S8BL_System['sc3000']
+    elif line[:3] == 'OMV':
+        kind = S8BL_System['omv']
+    elif line[:3] == 'SMS':
+        kind = S8BL_System['sms']
+    elif line[:3] == 'SF7':
+        kind = S8BL_System['sf7000']
+    return kind
+
+
+def parse_line(line: str):
+    # Entry for one meka.nam line, None for blank lines and comments
+    line = line.strip()
+    if len(line) < 1:
+        return None
+    if line[:1] == ';':
+        return None
+    if line[:2] == '--':
+        return None
+    kind = line_system(line)
+    if kind is not None:
+        return parse_new(kind, line)
+    return parse_old(line)
+
+
+def iter_entries(infile) -> Iterator[Tuple[int, S8BL_LibraryEntry]]:
+    # (line number, entry) for every entry in a meka.nam stream, one line in memory at a time.
+    # Any iterable of lines works: text files, binary ones such as gzip.open(path), sys.stdin
+    for lineno, line in enumerate(infile, 1):
+        if isinstance(line, bytes):
+            line = line.decode(NAM_ENCODING)
+        entry = parse_line(line)
+        if entry is not None:
+            yield lineno, entry
+
+
+def parse_stream(infile) -> Iterator[S8BL_LibraryEntry]:
+    # Entries only, for S8BL_Library.merge_library(parse_stream(infile)). Use iter_entries() for line numbers
+    for lineno, entry in iter_entries(infile):
+        yield entry
+
+
+def open_nam(path: str):
+    # Plain, gzip or xz compressed, told apart by their magic like s8bl.json
+    return open_profile(path, detect_profile(path), 'r')
+
+
+def iter_files(*paths: str) -> Iterator[Tuple[str, int, S8BL_LibraryEntry]]:
+    # (path, line number, entry) over several files, as if concatenated
+    for path in paths:
+        with open_nam(path) as infile:
+            for lineno, entry in iter_entries(infile):
+                yield path, lineno, entry
+
+
+def parse_file(path: str) -> List[S8BL_LibraryEntry]:
+    # Every entry of a meka.nam file, in file order
+    return [entry for path, lineno, entry in iter_files(path)]
+
+
 def main():
     lib = S8BL_Library()
     if os.path.isfile('s8bl.json'):
-        lib.load('s8bl.json')
-    with open('meka.nam', 'r') as infile:
-        lines = infile.readlines()
-    for line in lines:
-        kind = None
-        line = line.strip()
-        if len(line) < 1:
-            continue
-        if line[:1] == ';':
-            continue
-        if line[:2] == '--':
-            continue
-        if line[:2] == 'GG':
-            kind = S8BL_System['gg']
-        elif line[:3] == 'SG1':
-            kind = S8BL_System['sg1000']
-        elif line[:3] == 'SC3':
-            kind = S8BL_System['sc3000']
-        elif line[:3] == 'OMV':
-            kind = S8BL_System['omv']
-        elif line[:3] == 'SMS':
-            kind = S8BL_System['sms']
-        elif line[:3] == 'SF7':
-            kind = S8BL_System['sf7000']
-        if kind is not None:
-            r = parse_new(lib, kind, line)
-        else:
-            r = parse_old(lib, line)
-        lib.merge_in(r)
+        lib.load('s8bl.json', snapshot=True)
+    for path, lineno, r in iter_files('meka.nam'):
+        for conflict in lib.merge_in(r):
+            print('CONFLICT', '%s:%d' % (path, lineno), conflict.member, conflict.current, conflict.incoming,
+                  conflict.entry.names)
     lib.save('s8bl2_meka_totalsms.json')
-        # print(line)
 
 
 if __name__ == '__main__':
@@ -4,8 +4,9 @@ The point of this is to dump TotalJustice's database into ours.
 
 import re
 import os
+from typing import List
 
-from s8bl.s8bl import S8BL_LibraryEntry, S8BL_Library, S8BL_System, S8BL_Mapper
+from s8bl.s8bl import S8BL_LibraryEntry, S8BL_Library, S8BL_System, S8BL_Mapper, S8BL_MergeRules
 
 name_regex = re.compile(r'// [a-zA-Z\'&+%#~,0-9\-() _\[\]\.\!]*')
 crc_regex = re.compile(r'\.crc = 0x[0-9A-F]+,')
@@ -31,13 +32,16 @@ TJ_SYS_TO_OURS = {
 }
 
 
-def main(what):
+# addFromTotal() as merge rules: TotalJustice's names, sizes, mapper and system overwrite ours
+TJ_MERGE_RULES = dict(S8BL_MergeRules, **{member: ('prefer_source', (), 'keep') for member in (
+    'names', 'ROM_size', 'RAM_size', 'mapper', 'system')})
+
+
+def parse_entries(what) -> List[S8BL_LibraryEntry]:
     # Format:
     # <t>// 20 - em - 1(B)[!].sms
     # <t>{.crc = 0xF0F35C22,.rom = 0x40000,.ram = 0x0000,.map = MAPPER_TYPE_SEGA,.sys = SMS_System_SMS},
-    lib = S8BL_Library()
-    if os.path.isfile('s8bl.json'):
-        lib.load('s8bl.json')
+    out = []
     entry = S8BL_LibraryEntry()
     for line in what.split('\n'):
         f = name_regex.findall(line)
@@ -54,7 +58,23 @@ def main(what):
             ram = ram_regex.findall(line)[0][7:-1]
             smap = TJ_MAPPER_TO_OURS[map_regex.findall(line)[0][7:-1]]
             msys = TJ_SYS_TO_OURS[sys_regex.findall(line)[0][7:]]
-            lib.addFromTotal(entry.names[0], int(crc, 16), int(rom, 16), int(ram, 16), smap, msys)
+            e = S8BL_LibraryEntry()
+            e.names = [entry.names[0]]
+            e.CRC32 = int(crc, 16)
+            e.ROM_size = int(rom, 16)
+            e.RAM_size = int(ram, 16)
+            e.mapper = smap
+            e.system = msys
+            out.append(e)
+    return out
+
+
+def main(what):
+    lib = S8BL_Library()
+    if os.path.isfile('s8bl.json'):
+        lib.load('s8bl.json', snapshot=True)
+    for e in parse_entries(what):
+        lib.addFromTotal(e.names[0], e.CRC32, e.ROM_size, e.RAM_size, e.mapper, e.system)
     lib.save('s8bl.json')
 
 
@@ -0,0 +1,210 @@
+""" Compact binary database format, meant to be opened with mmap.
+
+Layout, all little endian:
+    header      HEADER struct
+    CRC32 array uint32 per entry, sorted, for bisect lookups
+    records     RECORD struct per entry, same order as the CRC32 array
+    strings     per entry: names then alt_names, each a uint16 length + UTF-8 bytes
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import List, Optional
+
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, S8BL_Country, S8BL_Country_R
+
+MAGIC = b'S8BL'
+VERSION = 2
+# magic, version, record size, entry count, CRC32 array offset, records offset, strings offset, strings size
+HEADER = struct.Struct('<4sHHIIIII')
+# CRC32, ROM_size, RAM_size, MekaCRC, countries mask, strings offset, names count, alt_names count,
+# system, mapper, set flags mask, known flags mask, presence bits. Both flag masks are kept so a flag
+# known to be clear stays False, unlike in JSON
+RECORD = struct.Struct('<IIIQIIHHBBHHB')
+
+HAS_MEKACRC = 1
+HAS_ROM_SIZE = 2
+HAS_RAM_SIZE = 4
+HAS_MAPPER = 8
+HAS_SYSTEM = 16
+
+LENGTH = struct.Struct('<H')
+
+
+def flags_mask(entry: S8BL_LibraryEntry) -> int:
+    # Set flags, S8BL_Flag bits are already in S8BL_Flag_Names order
+    return entry.flags.value
+
+
+def countries_mask(entry: S8BL_LibraryEntry) -> int:
+    # Countries are saved as comma separated strings. A code outside S8BL_Country raises rather than
+    # being dropped from the mask, it has to be added there
+    mask = 0
+    for countries in entry.countries or []:
+        for code in countries.split(','):
+            code = code.strip()
+            if not code:
+                continue
+            if code not in S8BL_Country:
+                raise ValueError('Unknown country code %s for %s' % (code, entry.names))
+            mask |= 1 << S8BL_Country[code]
+    return mask
+
+
+def countries_from_mask(mask: int) -> Optional[List[str]]:
+    if mask == 0:
+        return None
+    return [','.join(S8BL_Country_R[bit] for bit in sorted(S8BL_Country_R) if mask & (1 << bit))]
+
+
+def _pack_strings(out: bytearray, strings: List[str]) -> None:
+    for s in strings:
+        raw = s.encode('utf-8')
+        out += LENGTH.pack(len(raw))
+        out += raw
+
+
+def save_binary(lib: S8BL_Library, path: str) -> None:
+    entries = sorted(lib.db, key=lambda e: e.CRC32)
+    count = len(entries)
+    crcs = array('I', [e.CRC32 for e in entries])
+    if sys.byteorder != 'little':
+        crcs.byteswap()
+    crc_offset = HEADER.size
+    records_offset = crc_offset + 4 * count
+    strings_offset = records_offset + RECORD.size * count
+    records = bytearray()
+    strings = bytearray()
+    for e in entries:
+        names = list(e.names)
+        alt_names = list(e.alt_names or [])
+        has = 0
+        mekacrc = 0
+        if e.MekaCRC is not None:
+            has |= HAS_MEKACRC
+            mekacrc = int(e.MekaCRC, 16)
+        if e.ROM_size is not None:
+            has |= HAS_ROM_SIZE
+        if e.RAM_size is not None:
+            has |= HAS_RAM_SIZE
+        if e.mapper is not None:
+            has |= HAS_MAPPER
+        if e.system is not None:
+            has |= HAS_SYSTEM
+        records += RECORD.pack(e.CRC32, e.ROM_size or 0, e.RAM_size or 0, mekacrc, countries_mask(e), len(strings),
+                               len(names), len(alt_names), e.system or 0, e.mapper or 0, flags_mask(e),
+                               e.flags.known, has)
+        _pack_strings(strings, names + alt_names)
+
+    tpath = path + '.tmp'
+    with open(tpath, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count, crc_offset, records_offset, strings_offset,
+                                  len(strings)))
+        outfile.write(crcs.tobytes())
+        outfile.write(records)
+        outfile.write(strings)
+    os.replace(tpath, path)
+
+
+class S8BL_BinaryLibrary:
+    # Read-only view of a binary database. Lookups bisect the mmapped CRC32 array and only decode
+    # the records they hit, answering like S8BL_Library.CRC_to_db
+    def __init__(self, path: str):
+        self.path: str = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, count, crc_offset, records_offset, strings_offset, strings_size = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError('%s is not a version %d S8BL binary database' % (path, VERSION))
+        self.count: int = count
+        self.records_offset: int = records_offset
+        self.strings_offset: int = strings_offset
+        if sys.byteorder == 'little':
+            self.crcs = memoryview(self._mm)[crc_offset:crc_offset + 4 * count].cast('I')
+        else:
+            self.crcs = array('I', self._mm[crc_offset:crc_offset + 4 * count])
+            self.crcs.byteswap()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, crc: int) -> bool:
+        return self.find(crc) >= 0
+
+    def __getitem__(self, crc: int) -> S8BL_LibraryEntry:
+        entry = self.get(crc)
+        if entry is None:
+            raise KeyError(crc)
+        return entry
+
+    def find(self, crc: int) -> int:
+        # Index of the record with this CRC32, or -1. Records are stably sorted, so on duplicates the
+        # last one in db order wins, the same entry S8BL_Library.load leaves in CRC_to_db.
+        # CRC 0 is stored for MekaCRC-only entries and is never looked up, as in CRC_to_db
+        if crc == 0:
+            return -1
+        i = bisect_right(self.crcs, crc) - 1
+        if i >= 0 and self.crcs[i] == crc:
+            return i
+        return -1
+
+    def get(self, crc: int, default=None) -> Optional[S8BL_LibraryEntry]:
+        i = self.find(crc)
+        if i < 0:
+            return default
+        return self.entry(i)
+
+    def entry(self, i: int) -> S8BL_LibraryEntry:
+        crc, rom_size, ram_size, mekacrc, countries, soffset, nnames, nalt, system, mapper, flags, known, has = \
+            RECORD.unpack_from(self._mm, self.records_offset + i * RECORD.size)
+        strings = self._strings(self.strings_offset + soffset, nnames + nalt)
+        e = S8BL_LibraryEntry()
+        e.CRC32 = crc
+        e.names = strings[:nnames]
+        if nalt > 0:
+            e.alt_names = strings[nnames:]
+        if has & HAS_MEKACRC:
+            e.MekaCRC = '%016X' % mekacrc
+        if has & HAS_ROM_SIZE:
+            e.ROM_size = rom_size
+        if has & HAS_RAM_SIZE:
+            e.RAM_size = ram_size
+        if has & HAS_MAPPER:
+            e.mapper = mapper
+        if has & HAS_SYSTEM:
+            e.system = system
+        e.countries = countries_from_mask(countries)
+        e.flags.known = known
+        e.flags.value = flags
+        return e
+
+    def _strings(self, offset: int, count: int) -> List[str]:
+        out = []
+        for i in range(count):
+            n = LENGTH.unpack_from(self._mm, offset)[0]
+            offset += LENGTH.size
+            out.append(self._mm[offset:offset + n].decode('utf-8'))
+            offset += n
+        return out
+
+    def close(self) -> None:
+        if isinstance(self.__dict__.get('crcs'), memoryview):
+            self.crcs.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_binary(path: str) -> S8BL_BinaryLibrary:
+    return S8BL_BinaryLibrary(path)
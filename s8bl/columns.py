@@ -0,0 +1,143 @@
+""" Columnar view of an S8BL_Library for aggregate queries.
+
+One parallel array per column, row i describing lib.db[i]. Unknown sizes, mappers and systems are 0.
+With NumPy installed the columns are exposed as ndarrays sharing the array buffers, and filters and
+group-bys run vectorized; without it the same helpers run over the plain arrays.
+"""
+
+from array import array
+from collections import Counter
+from typing import List, Dict, Optional, Union
+
+from s8bl.binfmt import countries_mask
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, S8BL_System, S8BL_Mapper, S8BL_Country, S8BL_Country_R, \
+    S8BL_Flag_Bits
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column name -> array typecode
+COLUMNS = {
+    'CRC32': 'I',
+    'ROM_size': 'q',
+    'RAM_size': 'q',
+    'mapper': 'B',
+    'system': 'B',
+    'flags': 'H',  # set flags, S8BL_Flag bits
+    'flags_known': 'H',  # known flags, S8BL_Flag bits
+    'countries': 'I',  # 1 << S8BL_Country per listed country
+}
+
+
+class S8BL_Columns:
+    def __init__(self, db: List[S8BL_LibraryEntry], use_numpy: Optional[bool] = None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy and numpy is None:
+            raise ImportError('numpy is not installed')
+        self.db: List[S8BL_LibraryEntry] = db
+        self.numpy: bool = use_numpy
+        cols = {name: array(code) for name, code in COLUMNS.items()}
+        crc, rom, ram, mapper, system, flags, known, countries = cols.values()
+        for e in db:
+            crc.append(e.CRC32)
+            rom.append(e.ROM_size or 0)
+            ram.append(e.RAM_size or 0)
+            mapper.append(e.mapper or 0)
+            system.append(e.system or 0)
+            flags.append(e.flags.value)
+            known.append(e.flags.known)
+            countries.append(countries_mask(e))
+        for name, col in cols.items():
+            if use_numpy:
+                col = numpy.frombuffer(col, dtype=col.typecode)
+            setattr(self, name, col)
+
+    def __len__(self) -> int:
+        return len(self.db)
+
+    def column(self, name: str, rows=None):
+        # Whole column, or only the given row numbers
+        if name not in COLUMNS:
+            raise KeyError(name)
+        col = getattr(self, name)
+        if rows is None:
+            return col
+        if self.numpy:
+            return col[rows]
+        return [col[i] for i in rows]
+
+    def select(self, system: Union[int, str, None] = None, mapper: Union[int, str, None] = None, flags: int = 0,
+               countries: Union[int, str] = 0, rows=None):
+        # Row numbers matching every condition given. system and mapper take names or values,
+        # flags and countries are masks (or a country code) whose bits must all be set
+        conds = []
+        if system is not None:
+            conds.append((self.system, S8BL_System[system] if isinstance(system, str) else system, False))
+        if mapper is not None:
+            conds.append((self.mapper, S8BL_Mapper[mapper] if isinstance(mapper, str) else mapper, False))
+        if flags:
+            conds.append((self.flags, int(flags), True))
+        if countries:
+            conds.append((self.countries, 1 << S8BL_Country[countries] if isinstance(countries, str) else countries,
+                          True))
+        if self.numpy:
+            sel = numpy.ones(len(self.db), dtype=bool)
+            for col, want, is_mask in conds:
+                sel &= (col & want) == want if is_mask else col == want
+            found = numpy.flatnonzero(sel)
+            return found if rows is None else numpy.intersect1d(found, rows)
+        found = range(len(self.db)) if rows is None else rows
+        for col, want, is_mask in conds:
+            if is_mask:
+                found = [i for i in found if col[i] & want == want]
+            else:
+                found = [i for i in found if col[i] == want]
+        return list(found)
+
+    def entries(self, rows) -> List[S8BL_LibraryEntry]:
+        return [self.db[i] for i in rows]
+
+    def group_count(self, name: str, rows=None) -> Dict[int, int]:
+        # Value -> number of rows, sorted by value
+        col = self.column(name, rows)
+        if self.numpy:
+            values, counts = numpy.unique(col, return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        return dict(sorted(Counter(col).items()))
+
+    def group_by(self, key: str, value: str, rows=None) -> Dict[int, list]:
+        # Key value -> values of the other column in those rows, e.g. group_by('system', 'ROM_size')
+        keys = self.column(key, rows)
+        values = self.column(value, rows)
+        if self.numpy:
+            order = numpy.argsort(keys, kind='stable')
+            uniq, starts = numpy.unique(keys[order], return_index=True)
+            return dict(zip(uniq.tolist(), numpy.split(values[order], starts[1:])))
+        out = {}
+        for k, v in zip(keys, values):
+            out.setdefault(k, []).append(v)
+        return dict(sorted(out.items()))
+
+    def _bit_counts(self, name: str, bits, rows) -> Dict[str, int]:
+        # Few distinct masks exist, so count those first and expand them bit by bit
+        masks = self.group_count(name, rows)
+        return {nm: sum(n for mask, n in masks.items() if mask & bit) for nm, bit in bits}
+
+    def flag_counts(self, rows=None) -> Dict[str, int]:
+        return self._bit_counts('flags', S8BL_Flag_Bits, rows)
+
+    def country_counts(self, rows=None) -> Dict[str, int]:
+        return self._bit_counts('countries', [(S8BL_Country_R[b], 1 << b) for b in sorted(S8BL_Country_R)], rows)
+
+
+def library_columns(lib: S8BL_Library, use_numpy: Optional[bool] = None) -> S8BL_Columns:
+    # Built once and kept on the library until the next merge/replace/append drops it.
+    # Entries edited in place behind the library's back need lib.columns_cache = None
+    cols = lib.columns_cache
+    if cols is None or (use_numpy is not None and cols.numpy != use_numpy):
+        cols = S8BL_Columns(lib.db, use_numpy)
+        lib.columns_cache = cols
+    return cols
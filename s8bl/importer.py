@@ -0,0 +1,112 @@
+""" Import pipeline: every source is parsed concurrently into a batch of entries on a worker pool while the
+library loads, then a single merge stage feeds the batches through merge_library() in source order.
+Each batch is merged as soon as it and every earlier source's batch are ready, so the result does not
+depend on which parse finishes first. One load and one save per build.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Optional, Callable, Tuple
+
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, S8BL_MergeConflict, compile_merge_rules
+
+
+class S8BL_Source:
+    def __init__(self, name: str, parse: Callable, arg, rules: Optional[Dict[str, tuple]] = None):
+        # parse(arg) -> List[S8BL_LibraryEntry]. With the process pool both are pickled, so parse must be
+        # a module level function. rules as in S8BL_MergeRules for this source only, None for the library's own
+        self.name: str = name
+        self.parse: Callable = parse
+        self.arg = arg
+        self.rules: Optional[Dict[str, tuple]] = rules
+
+
+class S8BL_ImportReport:
+    def __init__(self):
+        # Stage -> seconds, in the order the stages ran. parse stages are timed inside the worker
+        self.timings: Dict[str, float] = {}
+        # Source name -> entries parsed / conflicts its merge returned
+        self.entries: Dict[str, int] = {}
+        self.conflicts: Dict[str, List[S8BL_MergeConflict]] = {}
+        self.library: Optional[S8BL_Library] = None
+        self.elapsed: float = 0.0
+
+    def summary(self) -> str:
+        stages = ', '.join('%s %.1f ms' % (stage, seconds * 1000) for stage, seconds in self.timings.items())
+        return '%d entries from %d sources, %d conflicts in %.2fs (%s)' % (
+            sum(self.entries.values()), len(self.entries), sum(len(c) for c in self.conflicts.values()),
+            self.elapsed, stages)
+
+
+def parse_source(parse: Callable, arg) -> Tuple[List[S8BL_LibraryEntry], float]:
+    # Runs in the worker, so the timing leaves out pickling and queueing
+    start = time.perf_counter()
+    entries = parse(arg)
+    return entries, time.perf_counter() - start
+
+
+class S8BL_Importer:
+    def __init__(self, sources: List[S8BL_Source], workers: Optional[int] = None,
+                 use_processes: Optional[bool] = None, snapshot: bool = True):
+        self.sources: List[S8BL_Source] = sources
+        cpus = os.cpu_count() or 1
+        self.workers: int = workers if workers is not None else max(1, min(len(sources), cpus))
+        # Parsing is pure Python and holds the GIL, so unlike the scanner processes are the default.
+        # On a single CPU they only add start-up and pickling costs, threads still overlap the load
+        self.use_processes: bool = use_processes if use_processes is not None else cpus > 1
+        self.snapshot: bool = snapshot
+
+    def _executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def run(self, db_path: Optional[str], out_path: Optional[str], profile: str = 'pretty') -> S8BL_ImportReport:
+        # Loads db_path (if it exists), merges every source and saves to out_path (if given)
+        report = S8BL_ImportReport()
+        start = time.perf_counter()
+        with self._executor() as pool:
+            futures = [pool.submit(parse_source, source.parse, source.arg) for source in self.sources]
+            t = time.perf_counter()
+            lib = S8BL_Library()
+            if db_path is not None and os.path.isfile(db_path):
+                lib.load(db_path, snapshot=self.snapshot)
+            lib.ensure_indexed()
+            report.timings['load'] = time.perf_counter() - t
+
+            # Merge in source order, waiting on each batch as it is needed
+            for source, future in zip(self.sources, futures):
+                t = time.perf_counter()
+                entries, parse_time = future.result()
+                report.timings['parse ' + source.name] = parse_time
+                report.timings['wait ' + source.name] = time.perf_counter() - t
+                report.entries[source.name] = len(entries)
+                t = time.perf_counter()
+                report.conflicts[source.name] = self._merge(lib, source, entries)
+                report.timings['merge ' + source.name] = time.perf_counter() - t
+
+        if out_path is not None:
+            t = time.perf_counter()
+            lib.save(out_path, profile)
+            report.timings['save'] = time.perf_counter() - t
+        report.library = lib
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    @staticmethod
+    def _merge(lib: S8BL_Library, source: S8BL_Source, entries: List[S8BL_LibraryEntry]) \
+            -> List[S8BL_MergeConflict]:
+        if source.rules is None:
+            return lib.merge_library(entries)
+        plan = lib.merge_plan
+        lib.merge_plan = compile_merge_rules(source.rules)
+        try:
+            return lib.merge_library(entries)
+        finally:
+            lib.merge_plan = plan
+
+
+def run_import(sources: List[S8BL_Source], db_path: Optional[str], out_path: Optional[str],
+               profile: str = 'pretty', **kwargs) -> S8BL_ImportReport:
+    return S8BL_Importer(sources, **kwargs).run(db_path, out_path, profile)
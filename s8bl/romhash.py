@@ -0,0 +1,312 @@
+import mmap
+import os
+import zlib
+from contextlib import contextmanager
+from typing import Union, List, Tuple, Optional
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+RomSource = Union[str, os.PathLike, bytes, bytearray, memoryview]
+
+# MEKA preprocessing, see the header of meka.nam:
+# - Sega 8-bits: 512-bytes header removed, 64-bytes footer removed
+# - ColecoVision: 128-bytes header removed, 512-bytes footer removed
+# - Duplicated data removed (2x/3x/4x+ overdumps)
+SEGA_HEADER_SIZE = 512
+SEGA_FOOTER_SIZE = 64
+COLECO_HEADER_SIZE = 128
+COLECO_FOOTER_SIZE = 512
+# ROM images are a whole number of KB, anything left over is a copier header or footer
+ROM_SIZE_GRANULARITY = 1024
+
+
+def is_buffer(source) -> bool:
+    # bytes, bytearray, memoryview, mmap and anything else exporting the buffer protocol
+    if isinstance(source, (str, os.PathLike)):
+        return False
+    try:
+        memoryview(source)
+    except TypeError:
+        return False
+    return True
+
+
+def crc32_buffer(data, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    # memoryview slices share the underlying buffer, so nothing is copied
+    mv = memoryview(data).cast('B')
+    crc = 0
+    for pos in range(0, len(mv), chunk_size):
+        crc = zlib.crc32(mv[pos:pos + chunk_size], crc)
+    return crc
+
+
+def crc32_file(path: Union[str, os.PathLike], chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    # Read into one reusable buffer instead of allocating a bytes object per chunk
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    crc = 0
+    with open(path, 'rb', buffering=0) as infile:
+        while True:
+            n = infile.readinto(buf)
+            if not n:
+                break
+            crc = zlib.crc32(mv[:n], crc)
+    return crc
+
+
+@contextmanager
+def mapped_rom(path: Union[str, os.PathLike]):
+    # Read-only memoryview over an mmap of the file. Views derived from it must be
+    # dropped before the block exits, the map cannot be closed while they exist.
+    with open(path, 'rb') as infile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            yield memoryview(b'')
+            return
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            mv = memoryview(mm)
+            try:
+                yield mv
+            finally:
+                mv.release()
+        finally:
+            mm.close()
+
+
+def _gf2_matrix_times(mat: List[int], vec: int) -> int:
+    out = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            out ^= mat[i]
+        vec >>= 1
+        i += 1
+    return out
+
+
+def _gf2_matrix_square(mat: List[int]) -> List[int]:
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+def _crc32_zeros_table(bits: int) -> Tuple[List[int], ...]:
+    # table[k] appends 2**k zero bytes to a CRC32
+    # Operator for one zero bit, squared three times gives one zero byte
+    op = [0xEDB88320] + [1 << n for n in range(31)]
+    for i in range(3):
+        op = _gf2_matrix_square(op)
+    table = []
+    for k in range(bits):
+        table.append(op)
+        op = _gf2_matrix_square(op)
+    return tuple(table)
+
+
+# Built once at import, read-only afterwards so the scanner's threads can share it. Covers lengths below 2**48
+CRC32_COMBINE_BITS = 48
+_crc32_zeros_ops = _crc32_zeros_table(CRC32_COMBINE_BITS)
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    # CRC32 of A+B from crc(A), crc(B) and len(B), same maths as zlib's crc32_combine
+    if len2 >> CRC32_COMBINE_BITS:
+        raise ValueError('crc32_combine length %d too large' % len2)
+    k = 0
+    while len2 > 0:
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(_crc32_zeros_ops[k], crc1)
+        len2 >>= 1
+        k += 1
+    return crc1 ^ crc2
+
+
+def _iter_chunks(source, chunk_size: int):
+    # memoryview chunks of a buffer or file, a file is read through one reusable buffer
+    if is_buffer(source):
+        mv = memoryview(source).cast('B')
+        for pos in range(0, len(mv), chunk_size):
+            yield mv[pos:pos + chunk_size]
+        return
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    with open(source, 'rb', buffering=0) as infile:
+        while True:
+            n = infile.readinto(buf)
+            if not n:
+                break
+            yield mv[:n]
+
+
+def _source_size(source) -> int:
+    if is_buffer(source):
+        return memoryview(source).nbytes
+    return os.path.getsize(source)
+
+
+def crc32_variants(source: RomSource, header: int = SEGA_HEADER_SIZE, footer: int = SEGA_FOOTER_SIZE,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, digests=()) -> Tuple[int, Optional[int], Optional[int]]:
+    # (full, header stripped, footer stripped) CRC32s in one read. Every byte goes through
+    # zlib.crc32 exactly once: head, middle and tail are hashed separately and stitched
+    # back together with crc32_combine. Stripped variants are None if the file is too small.
+    # hashlib objects in digests are fed the same chunks.
+    size = _source_size(source)
+    if size <= header + footer:
+        crc = 0
+        for chunk in _iter_chunks(source, chunk_size):
+            crc = zlib.crc32(chunk, crc)
+            for digest in digests:
+                digest.update(chunk)
+        return crc, None, None
+    bounds = (header, size - footer, size)
+    crcs = [0, 0, 0]
+    region = 0
+    pos = 0
+    for chunk in _iter_chunks(source, chunk_size):
+        for digest in digests:
+            digest.update(chunk)
+        start = 0
+        while start < len(chunk):
+            end = min(len(chunk), start + bounds[region] - pos)
+            crcs[region] = zlib.crc32(chunk[start:end], crcs[region])
+            pos += end - start
+            start = end
+            if pos == bounds[region] and region < 2:
+                region += 1
+    head, mid, tail = crcs
+    middle_len = size - header - footer
+    no_footer = crc32_combine(head, mid, middle_len)
+    full = crc32_combine(no_footer, tail, footer)
+    no_header = crc32_combine(mid, tail, footer)
+    return full, no_header, no_footer
+
+
+def crc32_variants_for(source: RomSource, colecovision: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       digests=()) -> Tuple[int, Optional[int], Optional[int]]:
+    if colecovision:
+        return crc32_variants(source, COLECO_HEADER_SIZE, COLECO_FOOTER_SIZE, chunk_size, digests)
+    return crc32_variants(source, SEGA_HEADER_SIZE, SEGA_FOOTER_SIZE, chunk_size, digests)
+
+
+def crc32_of(source: RomSource, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    if is_buffer(source):
+        return crc32_buffer(source, chunk_size)
+    return crc32_file(source, chunk_size)
+
+
+def strip_header_footer(data, colecovision: bool = False) -> memoryview:
+    mv = memoryview(data).cast('B')
+    extra = len(mv) % ROM_SIZE_GRANULARITY
+    if colecovision:
+        header, footer = COLECO_HEADER_SIZE, COLECO_FOOTER_SIZE
+    else:
+        header, footer = SEGA_HEADER_SIZE, SEGA_FOOTER_SIZE
+    if len(mv) > header and extra == header:
+        return mv[header:]
+    if len(mv) > footer and extra == footer:
+        return mv[:len(mv) - footer]
+    return mv
+
+
+# Repeat counts tried by the overdump check, 4x/8x/... are found by halving again
+OVERDUMP_SPLITS = (2, 3)
+
+
+def _words(mv: memoryview, start: int, end: int) -> memoryview:
+    # Equality on 'B' views goes byte by byte, 8-byte words compare about 8x faster
+    part = mv[start:end]
+    if len(part) % 8 == 0:
+        return part.cast('Q')
+    return part
+
+
+def detect_overdump(data) -> Tuple[int, int]:
+    # (canonical size, repeat count) of an image made of the same data repeated 2x/3x/4x+.
+    # The repeated parts are compared in place, as views, nothing is copied.
+    mv = memoryview(data).cast('B')
+    size = len(mv)
+    repeats = 1
+    found = True
+    while found:
+        found = False
+        for split in OVERDUMP_SPLITS:
+            part = size // split
+            if size % split != 0 or part < ROM_SIZE_GRANULARITY:
+                continue
+            first = _words(mv, 0, part)
+            if all(first == _words(mv, i * part, (i + 1) * part) for i in range(1, split)):
+                size = part
+                repeats *= split
+                found = True
+                break
+    return size, repeats
+
+
+def strip_overdump(data) -> memoryview:
+    mv = memoryview(data).cast('B')
+    return mv[:detect_overdump(mv)[0]]
+
+
+def overdump_crc32(data) -> Tuple[int, int]:
+    # (canonical size, CRC32 of the de-duplicated image)
+    mv = memoryview(data).cast('B')
+    size = detect_overdump(mv)[0]
+    return size, zlib.crc32(mv[:size])
+
+
+def meka_normalize(data, colecovision: bool = False) -> memoryview:
+    return strip_overdump(strip_header_footer(data, colecovision))
+
+
+def _xor_fold64(chunk) -> int:
+    # XOR of all little-endian 64-bit words in chunk, done as big int ops so the loop runs in C
+    x = int.from_bytes(chunk, 'little')
+    width = len(chunk) * 8
+    while width > 64:
+        half = (width // 128) * 64
+        x = (x & ((1 << half) - 1)) ^ (x >> half)
+        width -= half
+    return x
+
+
+# mekacrc_raw is not a verified port of MEKA's checksum.c and has no known (image, MekaCRC) vector
+# pinning it, so libraries do not match on computed MekaCRCs by default, see S8BL_Library.match_mekacrc.
+# tests/test_romhash.py compares it with meka.nam when S8BL_TEST_ROMS points at real dumps
+MEKACRC_VERIFIED = False
+
+
+def _mekacrc_lanes(x: int) -> int:
+    # 64-bit fold of an image -> MekaCRC value, the even words' lane printed first
+    return ((x & 0xFFFFFFFF) << 32) | (x >> 32)
+
+
+def mekacrc_raw(data, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    # Two 32-bit lanes, XOR of the even and of the odd little-endian words, trailing bytes ignored.
+    # Not checked against MEKA's checksum.c, see MEKACRC_VERIFIED.
+    # XOR folds chunk by chunk, so only one chunk is ever converted to an int.
+    mv = memoryview(data).cast('B')
+    size = len(mv) & ~7
+    chunk_size &= ~7
+    x = 0
+    for pos in range(0, size, chunk_size):
+        x ^= _xor_fold64(mv[pos:min(pos + chunk_size, size)])
+    return _mekacrc_lanes(x)
+
+
+def mekacrc_to_str(value: int) -> str:
+    return '%016X' % value
+
+
+def mekacrc(data, colecovision: bool = False) -> str:
+    return mekacrc_to_str(mekacrc_raw(meka_normalize(data, colecovision)))
+
+
+def rom_keys(data, colecovision: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, str]:
+    # CRC32 and MekaCRC of the normalized image in one pass, each chunk goes to both while it is in cache
+    mv = meka_normalize(data, colecovision)
+    chunk_size &= ~7
+    crc = 0
+    x = 0
+    for pos in range(0, len(mv), chunk_size):
+        chunk = mv[pos:pos + chunk_size]
+        crc = zlib.crc32(chunk, crc)
+        x ^= _xor_fold64(chunk[:len(chunk) & ~7])
+    return crc, mekacrc_to_str(_mekacrc_lanes(x))
@@ -1,7 +1,20 @@
+import gc
+import gzip
+import hashlib
 import json
+import lzma
+import marshal
 import os
+import re
+import unicodedata
+from collections import Counter
+from collections.abc import MutableMapping, MutableSequence
+from enum import IntFlag
 from shlex import shlex
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
+
+from s8bl.romhash import RomSource, DEFAULT_CHUNK_SIZE, MEKACRC_VERIFIED, crc32_variants_for, is_buffer, \
+    mapped_rom, overdump_crc32, rom_keys
 
 S8BL_System = {
     'unknown': 0,  # No associated system
@@ -59,42 +72,79 @@ S8BL_Country = {
     'CH': 13,
     'UK': 14,
     'CA': 15,
-    'TW': 16
+    'TW': 16,
+    'SP': 17,  # Spain
 }
 S8BL_Country_R = {v: k for k, v in S8BL_Country.items()}
 
+# Flag names as saved in the JSON 'flags' list, in save order
+S8BL_Flag_Names = ('bad', 'prototype', 'gg_sms_mode', 'needs_vdp1', 'translation', 'bios', 'hacks', 'homebrew',
+                   'is_3d', 'sprite_flicker')
+# S8BL_LibraryEntry members, sorted the way dir() used to list them, which is the key order of saved entries
+S8BL_Entry_Members = ('CRC32', 'MekaCRC', 'RAM_size', 'ROM_size', 'alt_names', 'comments', 'countries', 'date', 'flags',
+                      'identifier', 'inputs', 'mapper', 'misc', 'names', 'product_number', 'requires_ntsc',
+                      'requires_pal', 'system', 'translation', 'version')
+# Optional S8BL_LibraryEntry members that are saved as-is when not None
+S8BL_Optional_Members = ('MekaCRC', 'comments', 'product_number', 'version', 'countries', 'identifier',
+                         'translation', 'date', 'misc', 'alt_names', 'requires_ntsc', 'requires_pal', 'inputs')
+
+
+class S8BL_Flag(IntFlag):
+    # One bit per S8BL_Flag_Names entry, same order
+    bad = 1 << 0
+    prototype = 1 << 1
+    gg_sms_mode = 1 << 2
+    needs_vdp1 = 1 << 3
+    translation = 1 << 4
+    bios = 1 << 5
+    hacks = 1 << 6
+    homebrew = 1 << 7
+    is_3d = 1 << 8
+    sprite_flicker = 1 << 9
+
+
+# (name, bit) pairs in save order, bits as plain ints so the masks stay ints
+S8BL_Flag_Bits = tuple((nm, int(S8BL_Flag[nm])) for nm in S8BL_Flag_Names)
+S8BL_Flag_Bit = dict(S8BL_Flag_Bits)
+
 
 class S8BL_LibraryEntry_Flags:
+    # Tri-state flags as two masks: a bit set in known means the flag is known, and value then holds it.
+    # The flag names are also readable and writable as None/True/False attributes, see _flag_property
+    __slots__ = ('known', 'value')
+
     def __init__(self):
         # None/null refers to unknown
-        self.bad = None
-        self.prototype = None
-        self.gg_sms_mode = None
-        self.needs_vdp1 = None
-        self.translation = None
-        self.bios = None
-        self.hacks = None
-        self.homebrew = None
-        self.is_3d = None
-        self.sprite_flicker = None  # ???
+        self.known: int = 0
+        self.value: int = 0
 
     def toPyDict(self):
         return self.toSaveObject()
 
+    def fromPyDict(self, what: List[str]):
+        for nm in what:
+            bit = S8BL_Flag_Bit.get(nm)
+            if bit is not None:
+                self.known |= bit
+                self.value |= bit
+
     def merge(self, mfrom):
-        def dif(nm):
-            if getattr(mfrom, nm) is not None:
-                setattr(self, nm, getattr(mfrom, nm))
-        dif('bad')
-        dif('prototype')
-        dif('gg_sms_mode')
-        dif('needs_vdp1')
-        dif('translation')
-        dif('bios')
-        dif('hacks')
-        dif('homebrew')
-        dif('is_3d')
-        dif('sprite_flicker')
+        # Known flags in mfrom win, the others are kept
+        self.value = (self.value & ~mfrom.known) | mfrom.value
+        self.known |= mfrom.known
+
+    def is_set(self, flags: int) -> bool:
+        # True if every flag in flags is known to be set
+        flags = int(flags)
+        return self.value & flags == flags
+
+    @property
+    def set_flags(self) -> S8BL_Flag:
+        return S8BL_Flag(self.value)
+
+    @property
+    def known_flags(self) -> S8BL_Flag:
+        return S8BL_Flag(self.known)
 
     def parse_meka(self, instr: str):
         istr = instr
@@ -126,21 +176,38 @@ class S8BL_LibraryEntry_Flags:
             print('MISSING FIELDS', istr, instr)
 
     def toSaveObject(self):
-        o = []
-        if self.bad is not None: o.append('bad')
-        if self.prototype is not None: o.append('prototype')
-        if self.gg_sms_mode is not None: o.append('gg_sms_mode')
-        if self.needs_vdp1 is not None: o.append('needs_vdp1')
-        if self.translation is not None: o.append('translation')
-        if self.bios is not None: o.append('bios')
-        if self.hacks is not None: o.append('hacks')
-        if self.homebrew is not None: o.append('homebrew')
-        if self.is_3d is not None: o.append('is_3d')
-        if self.sprite_flicker is not None: o.append('sprite_flicker')
-        return o
+        # Names of the flags known to be set. JSON only holds those: a flag known to be clear
+        # saves like an unknown one, and loads back as unknown
+        value = self.value
+        return [nm for nm, bit in S8BL_Flag_Bits if value & bit]
+
+
+def _flag_property(bit: int) -> property:
+    def get(self: S8BL_LibraryEntry_Flags) -> Optional[bool]:
+        if self.known & bit:
+            return bool(self.value & bit)
+        return None
+
+    def set(self: S8BL_LibraryEntry_Flags, v: Optional[bool]) -> None:
+        if v is None:
+            self.known &= ~bit
+            self.value &= ~bit
+            return
+        self.known |= bit
+        if v:
+            self.value |= bit
+        else:
+            self.value &= ~bit
+    return property(get, set)
+
+
+for _nm, _bit in S8BL_Flag_Bits:
+    setattr(S8BL_LibraryEntry_Flags, _nm, _flag_property(_bit))
 
 
 class S8BL_LibraryEntry:
+    __slots__ = S8BL_Entry_Members
+
     def __init__(self):
         self.names: List[str] = []  #
         self.CRC32: int = 0  #
@@ -167,23 +234,16 @@ class S8BL_LibraryEntry:
 
     def toPyDict(self):
         o = {}
-        for member in self.members:
+        for member in S8BL_Entry_Members:
             mm = getattr(self, member)
             if member == 'flags':
-                o[member] = self.flags.toPyDict()
-                continue
-            if member == 'mapper':
-                if mm is None:
-                    mm = 0
-                o[member] = S8BL_Mapper_R[mm]
-                continue
-            if member == 'system':
-                if mm is None:
-                    mm = 0
-                o[member] = S8BL_System_R[mm]
-                continue
-            if getattr(self, member) is not None:
-                o[member] = getattr(self, member)
+                o[member] = mm.toPyDict()
+            elif member == 'mapper':
+                o[member] = S8BL_Mapper_R[mm or 0]
+            elif member == 'system':
+                o[member] = S8BL_System_R[mm or 0]
+            elif mm is not None:
+                o[member] = mm
         return o
 
     def merge_flags(self, mfrom: S8BL_LibraryEntry_Flags):
@@ -218,23 +278,503 @@ class S8BL_LibraryEntry:
         ainn(o, 'inputs')
 
     @property
-    def members(self) -> List[str]:
-        return [attr for attr in dir(self) if
-                attr != 'members' and not callable(getattr(self, attr)) and not attr.startswith("__")]
+    def members(self) -> Tuple[str, ...]:
+        return S8BL_Entry_Members
 
     def replace(self, mwith: 'S8BL_LibraryEntry') -> None:
         # Overwrite all our attributes
-        self.__init__()
-        for m in self.members:
+        for m in S8BL_Entry_Members:
             setattr(self, m, getattr(mwith, m))
 
+    def copy(self) -> 'S8BL_LibraryEntry':
+        # List, dict and flags members are copied as well, so merging into one never changes the other
+        obj = S8BL_LibraryEntry()
+        for m in S8BL_Entry_Members:
+            value = getattr(self, m)
+            if isinstance(value, (list, dict)):
+                value = value.copy()
+            setattr(obj, m, value)
+        obj.flags = S8BL_LibraryEntry_Flags()
+        obj.flags.known = self.flags.known
+        obj.flags.value = self.flags.value
+        return obj
+
     def fromPyObjectTotal(self, what):
         self.names = what['names']
         self.CRC32 = what['CRC32']
-        self.ROM_size = what['ROM_size']
-        self.RAM_size = what['RAM_size']
+        self.ROM_size = what.get('ROM_size')
+        self.RAM_size = what.get('RAM_size')
         self.mapper = S8BL_Mapper[what['mapper']]
         self.system = S8BL_System[what['system']]
+        # Merged databases (s8bl2_meka_totalsms.json) carry the Meka fields as well
+        for member in S8BL_Optional_Members:
+            if member in what:
+                setattr(self, member, what[member])
+        if 'flags' in what:
+            self.flags.fromPyDict(what['flags'])
+
+
+# How identify() matched a ROM to its entry
+S8BL_MatchRule = {
+    'none': 0,
+    'crc32': 1,  # CRC32 of the file as-is
+    'crc32_normalized': 2,  # CRC32 after MEKA preprocessing (header/footer/overdump removed)
+    'mekacrc': 3,  # MekaCRC after MEKA preprocessing, only with S8BL_Library.match_mekacrc
+    'crc32_zip_directory': 4,  # CRC32 stored in a zip central directory
+    'crc32_no_header': 5,  # CRC32 with the copier header skipped
+    'crc32_no_footer': 6,  # CRC32 with the footer skipped
+    'crc32_overdump': 7,  # CRC32 of a 2x/3x/4x+ overdump with the repeats removed
+}
+# Order identify() tries the one-pass CRC32 variants in
+S8BL_VariantRules = (S8BL_MatchRule['crc32'], S8BL_MatchRule['crc32_no_header'], S8BL_MatchRule['crc32_no_footer'])
+S8BL_MatchRule_R = {v: k for k, v in S8BL_MatchRule.items()}
+
+
+class S8BL_IdentifyResult:
+    def __init__(self, entry: Optional['S8BL_LibraryEntry'] = None, rule: int = 0, CRC32: int = 0,
+                 MekaCRC: Optional[str] = None):
+        self.entry: Optional[S8BL_LibraryEntry] = entry
+        self.rule: int = rule
+        self.CRC32: int = CRC32
+        self.MekaCRC: Optional[str] = MekaCRC
+
+    @property
+    def found(self) -> bool:
+        return self.entry is not None
+
+    @property
+    def rule_name(self) -> str:
+        return S8BL_MatchRule_R[self.rule]
+
+
+# What merge_in() does with one member of an entry already in the library
+S8BL_MergeAction = {
+    'keep': 0,  # keep the library's value
+    'take': 1,  # take the incoming value
+    'conflict': 2,  # keep the library's value and report an S8BL_MergeConflict
+    'union': 3,  # append incoming list items the library's list lacks
+    'merge': 4,  # S8BL_LibraryEntry_Flags.merge, incoming known flags win
+}
+S8BL_MergeAction_R = {v: k for k, v in S8BL_MergeAction.items()}
+# Matches every value in a precedence row
+MERGE_ANY = '*'
+
+# Precedence matrices: (library value, incoming value, action) rows, the first matching row wins
+S8BL_MapperPrecedence = (
+    (S8BL_Mapper['sega'], S8BL_Mapper['sega_32k_RAM'], 'take'),
+    (MERGE_ANY, S8BL_Mapper['none'], 'take'),
+    (S8BL_Mapper['none'], MERGE_ANY, 'take'),
+    (S8BL_Mapper['sega'], MERGE_ANY, 'take'),
+    (S8BL_Mapper['unique_castle'], MERGE_ANY, 'keep'),
+    (S8BL_Mapper['unique_othello'], MERGE_ANY, 'keep'),
+)
+S8BL_SystemPrecedence = (
+    (S8BL_System['sms'], S8BL_System['sc3000'], 'take'),
+    (S8BL_System['sg1000'], MERGE_ANY, 'keep'),
+    (S8BL_System['sms'], S8BL_System['sg1000'], 'take'),
+    (S8BL_System['gg'], S8BL_System['sms'], 'keep'),
+)
+# A 2 gives way to a 1 whatever the member, kept from the original if/elif chain
+S8BL_DefaultPrecedence = (
+    (2, 1, 'take'),
+)
+S8BL_SizePrecedence = S8BL_DefaultPrecedence + (
+    (MERGE_ANY, MERGE_ANY, 'keep'),
+)
+
+# Per member (policy, precedence rows, action when no row matches). Policies:
+#   union           lists, see S8BL_MergeAction
+#   flags           S8BL_LibraryEntry_Flags.merge
+#   prefer_source   take any non-null incoming value
+#   prefer_non_null take the incoming value if the library has none, keep ours if the incoming one is null,
+#                   then the precedence rows
+#   precedence      only the precedence rows
+# Equal values are always kept. Members not listed use S8BL_DefaultMergeRule
+S8BL_MergeRules = {
+    'names': ('union', (), 'keep'),
+    'flags': ('flags', (), 'keep'),
+    'mapper': ('precedence', S8BL_MapperPrecedence, 'keep'),
+    'system': ('prefer_non_null', S8BL_SystemPrecedence, 'conflict'),
+    'ROM_size': ('prefer_non_null', S8BL_SizePrecedence, 'conflict'),
+    'RAM_size': ('prefer_non_null', S8BL_SizePrecedence, 'conflict'),
+}
+S8BL_DefaultMergeRule = ('prefer_non_null', S8BL_DefaultPrecedence, 'conflict')
+
+
+class S8BL_MergeConflict:
+    def __init__(self, entry: 'S8BL_LibraryEntry', member: str, current, incoming):
+        # entry kept current, incoming was dropped
+        self.entry: S8BL_LibraryEntry = entry
+        self.member: str = member
+        self.current = current
+        self.incoming = incoming
+
+    def __repr__(self) -> str:
+        return 'S8BL_MergeConflict(%r, %s: %r kept over %r)' % (
+            self.entry.names[0] if len(self.entry.names) > 0 else self.entry.CRC32, self.member, self.current,
+            self.incoming)
+
+
+def _merge_resolver(policy: str, rows, default: str):
+    # Compiles one rule into resolve(current, incoming) -> S8BL_MergeAction, for values that differ
+    keep, take = S8BL_MergeAction['keep'], S8BL_MergeAction['take']
+    default = S8BL_MergeAction[default]
+    rows = tuple((cur, inc, S8BL_MergeAction[action]) for cur, inc, action in rows)
+
+    def precedence(current, incoming) -> int:
+        for cur, inc, action in rows:
+            if (cur is MERGE_ANY or cur == current) and (inc is MERGE_ANY or inc == incoming):
+                return action
+        return default
+
+    if policy == 'union':
+        action = S8BL_MergeAction['union']
+        return lambda current, incoming: action
+    if policy == 'flags':
+        action = S8BL_MergeAction['merge']
+        return lambda current, incoming: action
+    if policy == 'prefer_source':
+        return lambda current, incoming: keep if incoming is None else take
+    if policy == 'prefer_non_null':
+        def prefer_non_null(current, incoming) -> int:
+            if current is None:
+                return take
+            if incoming is None:
+                return keep
+            return precedence(current, incoming)
+        return prefer_non_null
+    if policy == 'precedence':
+        return precedence
+    raise ValueError('Unknown merge policy %s' % policy)
+
+
+def compile_merge_rules(rules: Dict[str, tuple], default_rule: tuple = S8BL_DefaultMergeRule) -> tuple:
+    # (member, resolver) for every S8BL_LibraryEntry member, the per-field dispatch merge_in() runs
+    return tuple((member, _merge_resolver(*rules.get(member, default_rule))) for member in S8BL_Entry_Members)
+
+
+S8BL_MergePlan = compile_merge_rules(S8BL_MergeRules)
+MERGE_TAKE = S8BL_MergeAction['take']
+MERGE_CONFLICT = S8BL_MergeAction['conflict']
+MERGE_UNION = S8BL_MergeAction['union']
+MERGE_FLAGS = S8BL_MergeAction['merge']
+
+
+# save()/load() file profiles. pretty is the checked-in indent=2 format, the others are
+# compact JSON, optionally compressed with stdlib codecs. load() detects the profile itself
+S8BL_SaveProfiles = ('pretty', 'compact', 'gzip', 'xz')
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+
+def detect_profile(path: str) -> str:
+    with open(path, 'rb') as infile:
+        head = infile.read(6)
+    if head[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if head == XZ_MAGIC:
+        return 'xz'
+    if head[:2] == b'[{':
+        return 'compact'
+    return 'pretty'
+
+
+def open_profile(path: str, profile: str, mode: str):
+    # Text mode file object for the given profile, mode is 'r' or 'w'
+    if profile == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if profile == 'xz':
+        return lzma.open(path, mode + 't', encoding='utf-8')
+    if profile in S8BL_SaveProfiles:
+        return open(path, mode, encoding='utf-8')
+    raise ValueError('Unknown save profile %s' % profile)
+
+
+# Bump when the snapshot layout changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 5
+
+
+def snapshot_path(path: str) -> str:
+    return path + '.snapshot'
+
+
+def snapshot_members() -> tuple:
+    # Every S8BL_LibraryEntry member but flags, which is snapshotted as its known and value masks
+    return tuple(m for m in S8BL_Entry_Members if m != 'flags')
+
+
+def snapshot_key(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    # (size, mtime_ns, SHA1) of the source database
+    st = os.stat(path)
+    digest = hashlib.sha1()
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    with open(path, 'rb', buffering=0) as infile:
+        while True:
+            n = infile.readinto(buf)
+            if not n:
+                break
+            digest.update(mv[:n])
+    return st.st_size, st.st_mtime_ns, digest.hexdigest()
+
+
+def entry_from_raw(raw: dict) -> 'S8BL_LibraryEntry':
+    entry = S8BL_LibraryEntry()
+    entry.fromPyObjectTotal(raw)
+    return entry
+
+
+class S8BL_LazyEntryList(MutableSequence):
+    # db for S8BL_Library.load(lazy=True). Starts out holding the raw JSON dicts and swaps
+    # each one for its S8BL_LibraryEntry the first time it is accessed. Not a list subclass, so every
+    # read (slices, reversed(), pop() and the other sequence methods) goes through __getitem__
+    def __init__(self, raw: List[dict]):
+        self.items: list = list(raw)
+        # S8BL_LazyCRCIndex holding positions into items, pinned before anything but an append moves them
+        self.crc_index: Optional['S8BL_LazyCRCIndex'] = None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.items)))]
+        item = self.items[i]
+        if type(item) is dict:
+            item = entry_from_raw(item)
+            self.items[i] = item
+        return item
+
+    def _pin_positions(self) -> None:
+        if self.crc_index is not None:
+            self.crc_index.resolve_all()
+            self.crc_index = None
+
+    def __setitem__(self, i, item) -> None:
+        self._pin_positions()
+        self.items[i] = item
+
+    def __delitem__(self, i) -> None:
+        self._pin_positions()
+        del self.items[i]
+
+    def insert(self, i: int, item) -> None:
+        self._pin_positions()
+        self.items.insert(i, item)
+
+    def append(self, item) -> None:
+        self.items.append(item)
+
+    def __iter__(self):
+        for i in range(len(self.items)):
+            yield self[i]
+
+    def __contains__(self, item) -> bool:
+        return any(entry is item or entry == item for entry in self)
+
+    def index(self, item, *args) -> int:
+        for i, entry in enumerate(self):
+            if entry is item or entry == item:
+                return i
+        raise ValueError('entry is not in db')
+
+    def copy(self) -> List['S8BL_LibraryEntry']:
+        return list(self)
+
+    @property
+    def materialized(self) -> int:
+        return sum(1 for item in self.items if type(item) is not dict)
+
+
+class S8BL_LazyCRCIndex(MutableMapping):
+    # CRC_to_db for S8BL_Library.load(lazy=True). Values start out as positions in db
+    # and are resolved to entries on access. Not a dict subclass, so dict(), ** unpacking, pop()
+    # and the other mapping methods all go through __getitem__
+    def __init__(self, db: S8BL_LazyEntryList):
+        self.db: S8BL_LazyEntryList = db
+        self.slots: Dict[int, Union[int, 'S8BL_LibraryEntry']] = {}
+        db.crc_index = self
+
+    def set_position(self, crc: int, pos: int) -> None:
+        self.slots[crc] = pos
+
+    def resolve_all(self) -> None:
+        # Swaps every position for its entry, after which db can be reordered
+        db = self.db
+        for crc, value in list(self.slots.items()):
+            if type(value) is int:
+                self.slots[crc] = db[value]
+
+    def __getitem__(self, crc: int) -> 'S8BL_LibraryEntry':
+        value = self.slots[crc]
+        if type(value) is int:
+            value = self.db[value]
+            self.slots[crc] = value
+        return value
+
+    def __setitem__(self, crc: int, entry: 'S8BL_LibraryEntry') -> None:
+        self.slots[crc] = entry
+
+    def __delitem__(self, crc: int) -> None:
+        del self.slots[crc]
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, crc) -> bool:
+        return crc in self.slots
+
+    def get(self, crc: int, default=None):
+        if crc in self.slots:
+            return self[crc]
+        return default
+
+    def copy(self) -> Dict[int, 'S8BL_LibraryEntry']:
+        return dict(self.items())
+
+
+class S8BL_PyDictStream(list):
+    # Passes for a list with json's encoder, but builds each entry's toPyDict() only as it is iterated
+    def __init__(self, db: List['S8BL_LibraryEntry']):
+        super().__init__()
+        self.db: List[S8BL_LibraryEntry] = db
+
+    def __iter__(self):
+        return (item.toPyDict() for item in self.db)
+
+    def __len__(self) -> int:
+        return len(self.db)
+
+    def __bool__(self) -> bool:
+        return len(self.db) > 0
+
+
+def normalize_primary_name(name: str) -> str:
+    # Case and whitespace insensitive key for names[0] lookups
+    return ' '.join(name.split()).casefold()
+
+
+def normalize_product_number(product_number: str) -> str:
+    return product_number.strip().upper()
+
+
+# File extensions dropped from names before fuzzy matching
+S8BL_Name_Extensions = ('.sms', '.gg', '.sg', '.sc', '.mv', '.omv', '.col', '.sf7', '.bin', '.rom')
+_SEARCH_TAGS = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+_SEARCH_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize_search_name(name: str) -> str:
+    # Lowercase words of a name without its extension, (...) and [...] tags or punctuation
+    base, ext = os.path.splitext(name)
+    if ext.lower() in S8BL_Name_Extensions:
+        name = base
+    return ' '.join(_SEARCH_SEPARATORS.sub(' ', _SEARCH_TAGS.sub(' ', name)).split()).casefold()
+
+
+_TITLE_ARTICLE = re.compile(r'^(.+?), (the|a|an)\b', re.IGNORECASE)
+
+
+def normalize_title(name: str) -> str:
+    # Key shared by the GoodTools, No-Intro and MEKA names of a game: extension, region and dump tags,
+    # accents and punctuation go, a trailing article moves to the front.
+    # 'Addams Family, The (E) [!].sms' and 'The Addams Family [v2]' both give 'the addams family'
+    base, ext = os.path.splitext(name)
+    if ext.lower() in S8BL_Name_Extensions:
+        name = base
+    name = _TITLE_ARTICLE.sub(r'\2 \1', _SEARCH_TAGS.sub(' ', name).strip())
+    name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    return ' '.join(_SEARCH_SEPARATORS.sub(' ', name).split()).casefold()
+
+
+def name_trigrams(normalized: str) -> Set[str]:
+    # Trigrams of each word padded with a space either side, so one and two letter words count too
+    grams = set()
+    for word in normalized.split():
+        padded = ' ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class S8BL_NameMatch:
+    def __init__(self, entry: S8BL_LibraryEntry, name: str, score: float, similarity: float):
+        self.entry: S8BL_LibraryEntry = entry
+        # Best matching names/alt_names string of entry
+        self.name: str = name
+        # Share of the query's trigrams found in name, results are ranked on it first
+        self.score: float = score
+        # Dice coefficient of the two trigram sets, ranks names covering the query equally well
+        self.similarity: float = similarity
+
+
+class S8BL_NameIndex:
+    # Trigram index over every names and alt_names string of a library, for fuzzy search
+    def __init__(self):
+        # Normalized name -> entries carrying it
+        self.names: Dict[str, Set[S8BL_LibraryEntry]] = {}
+        # Normalized name -> number of trigrams in it
+        self.gram_counts: Dict[str, int] = {}
+        self.trigram_to_names: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def entry_names(entry: S8BL_LibraryEntry) -> List[str]:
+        return list(entry.names) + list(entry.alt_names or [])
+
+    def add(self, entry: S8BL_LibraryEntry) -> None:
+        for name in self.entry_names(entry):
+            key = normalize_search_name(name)
+            holders = self.names.get(key)
+            if holders is None:
+                holders = self.names[key] = set()
+                grams = name_trigrams(key)
+                self.gram_counts[key] = len(grams)
+                trigram_to_names = self.trigram_to_names
+                for gram in grams:
+                    bucket = trigram_to_names.get(gram)
+                    if bucket is None:
+                        trigram_to_names[gram] = {key}
+                    else:
+                        bucket.add(key)
+            holders.add(entry)
+
+    def remove(self, entry: S8BL_LibraryEntry) -> None:
+        for name in self.entry_names(entry):
+            key = normalize_search_name(name)
+            holders = self.names.get(key)
+            if holders is None:
+                continue
+            holders.discard(entry)
+            if len(holders) > 0:
+                continue
+            del self.names[key]
+            del self.gram_counts[key]
+            for gram in name_trigrams(key):
+                bucket = self.trigram_to_names[gram]
+                bucket.discard(key)
+                if len(bucket) == 0:
+                    del self.trigram_to_names[gram]
+
+    def search(self, query: str, min_score: float = 0.3) -> List[Tuple[float, float, str]]:
+        # (score, similarity, normalized name) of the best names, best first
+        grams = name_trigrams(normalize_search_name(query))
+        if len(grams) == 0:
+            return []
+        hits = Counter()
+        for gram in grams:
+            bucket = self.trigram_to_names.get(gram)
+            if bucket is not None:
+                hits.update(bucket)
+        nq = len(grams)
+        ranked = []
+        for key, n in hits.items():
+            score = n / nq
+            if score >= min_score:
+                ranked.append((score, 2 * n / (nq + self.gram_counts[key]), key))
+        ranked.sort(reverse=True)
+        return ranked
 
 
 class S8BL_Library:
@@ -242,100 +782,490 @@ class S8BL_Library:
         self.valid: bool = False
         self.db: List[S8BL_LibraryEntry] = []
         self.CRC_to_db: Dict[int, S8BL_LibraryEntry] = {}
+        # Secondary indexes. Keys can be shared by several entries, so each maps to a bucket
+        self.MekaCRC_to_db: Dict[str, List[S8BL_LibraryEntry]] = {}
+        self.name_to_db: Dict[str, List[S8BL_LibraryEntry]] = {}
+        self.product_to_db: Dict[str, List[S8BL_LibraryEntry]] = {}
+        self.db_pos: Dict[S8BL_LibraryEntry, int] = {}
+        # Inverted indexes for query(), each key maps to the set of entries having it
+        self.system_to_db: Dict[int, Set[S8BL_LibraryEntry]] = {}
+        self.mapper_to_db: Dict[int, Set[S8BL_LibraryEntry]] = {}
+        self.country_to_db: Dict[str, Set[S8BL_LibraryEntry]] = {}
+        self.flag_to_db: Dict[int, Set[S8BL_LibraryEntry]] = {}
+        # False after a lazy load, the secondary indexes are built on first use
+        self.indexed: bool = True
+        # s8bl.columns.S8BL_Columns built by library_columns(), dropped whenever an entry is (un)indexed
+        self.columns_cache = None
+        # Compiled S8BL_MergeRules merge_in() resolves members with, see set_merge_rules()
+        self.merge_plan: tuple = S8BL_MergePlan
+        # Built by the first search_names(), then kept up to date like the other indexes
+        self.name_search: Optional[S8BL_NameIndex] = None
+        # normalize_title() of every names/alt_names string -> entries, built by the first find_by_title()
+        self.title_to_db: Optional[Dict[str, List[S8BL_LibraryEntry]]] = None
+        # Whether identify() and the scanner match computed MekaCRCs against MekaCRC_to_db, off while
+        # romhash.mekacrc_raw is unverified
+        self.match_mekacrc: bool = MEKACRC_VERIFIED
+
+    def ensure_indexed(self) -> None:
+        if not self.indexed:
+            self.reindex()
+
+    def _index_keys(self, entry: S8BL_LibraryEntry):
+        if entry.MekaCRC is not None:
+            yield self.MekaCRC_to_db, entry.MekaCRC
+        if len(entry.names) > 0:
+            yield self.name_to_db, normalize_primary_name(entry.names[0])
+        if entry.product_number is not None:
+            yield self.product_to_db, normalize_product_number(entry.product_number)
+
+    def _posting_keys(self, entry: S8BL_LibraryEntry):
+        yield self.system_to_db, entry.system or 0
+        yield self.mapper_to_db, entry.mapper or 0
+        for countries in entry.countries or []:
+            for code in countries.split(','):
+                yield self.country_to_db, code.strip()
+        value = entry.flags.value
+        for nm, bit in S8BL_Flag_Bits:
+            if value & bit:
+                yield self.flag_to_db, bit
+
+    @staticmethod
+    def _titles(entry: S8BL_LibraryEntry) -> Set[str]:
+        return {normalize_title(nm) for nm in S8BL_NameIndex.entry_names(entry)}
+
+    def _index_entry(self, entry: S8BL_LibraryEntry) -> None:
+        self.columns_cache = None
+        if self.name_search is not None:
+            self.name_search.add(entry)
+        if self.title_to_db is not None:
+            for title in self._titles(entry):
+                self.title_to_db.setdefault(title, []).append(entry)
+        for index, key in self._index_keys(entry):
+            index.setdefault(key, []).append(entry)
+        for index, key in self._posting_keys(entry):
+            index.setdefault(key, set()).add(entry)
+
+    def _unindex_entry(self, entry: S8BL_LibraryEntry) -> None:
+        self.columns_cache = None
+        if self.name_search is not None:
+            self.name_search.remove(entry)
+        if self.title_to_db is not None:
+            for title in self._titles(entry):
+                bucket = self.title_to_db.get(title)
+                if bucket is None or entry not in bucket:
+                    continue
+                bucket.remove(entry)
+                if len(bucket) == 0:
+                    del self.title_to_db[title]
+        for index, key in self._index_keys(entry):
+            bucket = index.get(key)
+            if bucket is None or entry not in bucket:
+                continue
+            bucket.remove(entry)
+            if len(bucket) == 0:
+                del index[key]
+        for index, key in self._posting_keys(entry):
+            bucket = index.get(key)
+            if bucket is None:
+                continue
+            bucket.discard(entry)
+            if len(bucket) == 0:
+                del index[key]
+
+    def _append(self, entry: S8BL_LibraryEntry) -> None:
+        self.db_pos[entry] = len(self.db)
+        self.db.append(entry)
+        self._index_entry(entry)
+
+    def reindex(self) -> None:
+        self.indexed = True
+        self.MekaCRC_to_db = {}
+        self.name_to_db = {}
+        self.product_to_db = {}
+        self.db_pos = {}
+        self.system_to_db = {}
+        self.mapper_to_db = {}
+        self.country_to_db = {}
+        self.flag_to_db = {}
+        self.name_search = None
+        self.title_to_db = None
+        for pos, entry in enumerate(self.db):
+            self.db_pos[entry] = pos
+            self._index_entry(entry)
+
+    def find_by_MekaCRC(self, MekaCRC: str) -> Optional[S8BL_LibraryEntry]:
+        self.ensure_indexed()
+        bucket = self.MekaCRC_to_db.get(MekaCRC)
+        return bucket[0] if bucket else None
+
+    def find_by_name(self, name: str) -> List[S8BL_LibraryEntry]:
+        self.ensure_indexed()
+        return list(self.name_to_db.get(normalize_primary_name(name), []))
+
+    def find_by_title(self, name: str) -> List[S8BL_LibraryEntry]:
+        # Entries with any names/alt_names string sharing normalize_title(name), in db order
+        self.ensure_indexed()
+        if self.title_to_db is None:
+            self.title_to_db = {}
+            for entry in self.db:
+                for title in self._titles(entry):
+                    self.title_to_db.setdefault(title, []).append(entry)
+        return sorted(self.title_to_db.get(normalize_title(name), []), key=self.db_pos.__getitem__)
+
+    def find_by_product_number(self, product_number: str) -> List[S8BL_LibraryEntry]:
+        self.ensure_indexed()
+        return list(self.product_to_db.get(normalize_product_number(product_number), []))
+
+    def with_flags(self, flags: int, unset: int = 0):
+        # Entries with every flag in flags known set and every flag in unset known clear,
+        # e.g. with_flags(S8BL_Flag.prototype, S8BL_Flag.bad). IntFlag operators run in Python, plain ints don't
+        flags = int(flags)
+        unset = int(unset)
+        for entry in self.db:
+            f = entry.flags
+            if f.value & flags == flags and f.known & ~f.value & unset == unset:
+                yield entry
+
+    def query(self, system: Union[int, str, None] = None, mapper: Union[int, str, None] = None,
+              country: Optional[str] = None, flags: int = 0) -> Iterator[S8BL_LibraryEntry]:
+        # Lazy iterator over the entries matching every condition given, in db order.
+        # system and mapper take names or values, flags is a mask of S8BL_Flag bits that must all be set,
+        # e.g. query(system='gg', flags=S8BL_Flag.gg_sms_mode)
+        self.ensure_indexed()
+        if isinstance(system, str):
+            system = S8BL_System[system]
+        if isinstance(mapper, str):
+            mapper = S8BL_Mapper[mapper]
+        postings = []
+        if system is not None:
+            postings.append(self.system_to_db.get(system, ()))
+        if mapper is not None:
+            postings.append(self.mapper_to_db.get(mapper, ()))
+        if country is not None:
+            postings.append(self.country_to_db.get(country, ()))
+        for nm, bit in S8BL_Flag_Bits:
+            if flags & bit:
+                postings.append(self.flag_to_db.get(bit, ()))
+        if len(postings) == 0:
+            return iter(self.db)
+        return self._query_postings(postings)
+
+    def _query_postings(self, postings) -> Iterator[S8BL_LibraryEntry]:
+        # Walk the smallest posting set in db order and probe the others
+        postings = sorted(postings, key=len)
+        first, rest = postings[0], postings[1:]
+        for entry in sorted(first, key=self.db_pos.__getitem__):
+            if all(entry in p for p in rest):
+                yield entry
+
+    def search_names(self, query: str, limit: int = 10, min_score: float = 0.3) -> List[S8BL_NameMatch]:
+        # Fuzzy search over names and alt_names, best match first, e.g. search_names('alex kid miracle').
+        # Entries sharing an equally ranked name come in db order
+        self.ensure_indexed()
+        if self.name_search is None:
+            self.name_search = S8BL_NameIndex()
+            for entry in self.db:
+                self.name_search.add(entry)
+        results = []
+        seen = set()
+        for score, similarity, key in self.name_search.search(query, min_score):
+            for entry in sorted(self.name_search.names[key], key=self.db_pos.__getitem__):
+                if entry in seen:
+                    continue
+                seen.add(entry)
+                name = next(nm for nm in S8BL_NameIndex.entry_names(entry) if normalize_search_name(nm) == key)
+                results.append(S8BL_NameMatch(entry, name, score, similarity))
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def _first_in_db(self, *buckets) -> Optional[S8BL_LibraryEntry]:
+        # Earliest entry in db order across the candidate buckets, like a linear scan would return
+        found = None
+        for bucket in buckets:
+            if not bucket:
+                continue
+            for entry in bucket:
+                if found is None or self.db_pos[entry] < self.db_pos[found]:
+                    found = entry
+        return found
+
+    def replace(self, entry: S8BL_LibraryEntry, mwith: S8BL_LibraryEntry) -> None:
+        self.ensure_indexed()
+        self._unindex_entry(entry)
+        entry.replace(mwith)
+        self._index_entry(entry)
 
     def addFromTotal(self, names=None, CRC32: int = 0, ROM_size: Optional[int] = None, RAM_size: Optional[int] = None,
                      mapper: Optional[int] = None, system: Optional[int] = None):
+        self.ensure_indexed()
         if names is None:
             names = []
+        if isinstance(names, str):
+            names = [names]
         if CRC32 in self.CRC_to_db:
             obj = self.CRC_to_db[CRC32]
+            self._unindex_entry(obj)
+            isnew = False
         else:
             obj = S8BL_LibraryEntry()
+            isnew = True
         obj.names = names
         obj.CRC32 = CRC32
         obj.ROM_size = ROM_size
         obj.RAM_size = RAM_size
         obj.mapper = mapper
         obj.system = system
-        self.db.append(obj)
+        if CRC32 != 0:
+            self.CRC_to_db[CRC32] = obj
+        if isnew:
+            self._append(obj)
+        else:
+            self._index_entry(obj)
 
-    def merge_in(self, to: S8BL_LibraryEntry) -> None:
-        found = None
+    def set_merge_rules(self, rules: Dict[str, tuple], default_rule: tuple = S8BL_DefaultMergeRule) -> None:
+        # rules as in S8BL_MergeRules, members not listed get default_rule
+        self.merge_plan = compile_merge_rules(rules, default_rule)
+
+    def merge_in(self, to: S8BL_LibraryEntry, match_titles: bool = False) -> List[S8BL_MergeConflict]:
+        # Conflicts self.merge_plan could not settle are returned, the library's values are kept for them.
+        # match_titles also joins a CRC-less entry to a CRC-less one with the same normalize_title(names[0]).
+        # Off by default: MEKA's [A]/[B] variants share a title but are separate dumps
+        self.ensure_indexed()
         # Deal with MekaCRC-only ones
         if to.CRC32 == 0:
             # print('WEIRD ENTRY', to.names)
-            for entry in self.db:
-                if (entry.MekaCRC is not None and entry.MekaCRC == to.MekaCRC) or (entry.names[0] == to.names[0]):
-                    entry.replace(to)
-                    return
-            self.db.append(to)
-            return
+            found = self._join_crcless(to, match_titles)
+            if found is not None:
+                self.replace(found, to)
+                return []
+            self._append(to)
+            return []
 
         # Scan for CRC and update
         if to.CRC32 in self.CRC_to_db:
             entry = self.CRC_to_db[to.CRC32]
-            if entry.mapper != to.mapper:
-                if to.mapper == 2 and entry.mapper == 1:
-                    entry.mapper = 2
-                elif to.mapper == 0:
-                    entry.mapper = to.mapper
-                elif entry.mapper == 0:
-                    entry.mapper = to.mapper
-                elif entry.mapper == 1:
-                    entry.mapper = to.mapper
-                elif entry.mapper in [6, 7]:
-                    pass
-            for nm in to.names:
-                if nm not in entry.names:
-                    entry.names.append(nm)
-            members = entry.members
-            for member in members:
-                if member == 'names' or member == 'mapper':
-                    continue
-                entry_m = getattr(entry, member)
-                to_m = getattr(to, member)
-                if member == 'flags':
-                    entry.merge_flags(to.flags)
-                    continue
-                if to_m is None and entry_m is None:
-                    continue
-                if entry_m is None and to_m is not None:
-                    setattr(entry, member, to_m)
-                    continue
-                if entry_m == to_m:
-                    continue
-                if member == 'system' and entry_m == 2 and to_m == 4:
-                    setattr(entry, member, to_m)
-                    continue
-                if member == 'system' and entry_m == 1 and to_m != 1:
-                    continue
-                if entry_m == 2 and to_m == 1:
-                    setattr(entry, member, to_m)
-                    continue
-                if member == "ROM_size" or member == 'RAM_size':
-                    continue
-                if member == 'system' and entry_m == 3 and to_m == 2:
-                    continue
-                print('GOT HERE...', member, entry_m, to_m, entry.names)
-            return
+            self._unindex_entry(entry)
+            conflicts = self._merge_members(entry, to)
+            self._index_entry(entry)
+            return conflicts
         # Replace!
         self.CRC_to_db[to.CRC32] = to
-        self.db.append(to)
+        self._append(to)
+        return []
 
-    def load(self, path: str) -> None:
+    def merge_library(self, other: Union['S8BL_Library', Iterable[S8BL_LibraryEntry]],
+                      match_titles: bool = False) -> List[S8BL_MergeConflict]:
+        # merge_in() every entry of other, in order. Entries of a library are copied, so later merges into either
+        # library leave the other alone. Entries of any other iterable (dump_Meka.parse_stream()) are taken over
+        # as they are, lists included: copy() them first if the caller keeps using them.
+        # The CRC, MekaCRC and name indexes are still updated per entry, one rebuild after the loop measured no
+        # faster on meka.nam. Only the fuzzy search index is dropped, the next search_names() rebuilds it
+        self.name_search = None
+        conflicts = []
+        if isinstance(other, S8BL_Library):
+            other = (entry.copy() for entry in other.db)
+        for to in other:
+            conflicts.extend(self.merge_in(to, match_titles))
+        return conflicts
+
+    def _join_crcless(self, to: S8BL_LibraryEntry, match_titles: bool) -> Optional[S8BL_LibraryEntry]:
+        # Earliest entry sharing to's MekaCRC or primary name, then optionally a CRC-less one sharing its title
+        mbucket = self.MekaCRC_to_db.get(to.MekaCRC) if to.MekaCRC is not None else None
+        nbucket = self.name_to_db.get(normalize_primary_name(to.names[0])) if len(to.names) > 0 else None
+        found = self._first_in_db(mbucket, nbucket)
+        if found is None and match_titles and len(to.names) > 0:
+            found = self._first_in_db([e for e in self.find_by_title(to.names[0]) if e.CRC32 == 0])
+        return found
+
+    def _merge_members(self, entry: S8BL_LibraryEntry, to: S8BL_LibraryEntry) -> List[S8BL_MergeConflict]:
+        # Applies self.merge_plan to entry in place, no index upkeep
+        conflicts = []
+        for member, resolve in self.merge_plan:
+            current = getattr(entry, member)
+            incoming = getattr(to, member)
+            if current == incoming:
+                continue
+            action = resolve(current, incoming)
+            if action == MERGE_TAKE:
+                setattr(entry, member, incoming)
+            elif action == MERGE_CONFLICT:
+                conflicts.append(S8BL_MergeConflict(entry, member, current, incoming))
+            elif action == MERGE_UNION:
+                for nm in incoming:
+                    if nm not in current:
+                        current.append(nm)
+            elif action == MERGE_FLAGS:
+                current.merge(incoming)
+        return conflicts
+
+    def identify(self, source: RomSource, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 colecovision: Optional[bool] = None) -> S8BL_IdentifyResult:
+        # source is a path, or anything exposing the buffer protocol (bytes, bytearray, memoryview, mmap).
+        # Paths are mmapped, so large multicarts and overdumps are hashed without being read into memory
+        if is_buffer(source):
+            return self.identify_buffer(source, chunk_size, bool(colecovision))
+        if colecovision is None:
+            colecovision = os.fspath(source).lower().endswith('.col')
+        with mapped_rom(source) as mv:
+            return self.identify_buffer(mv, chunk_size, colecovision)
+
+    def identify_buffer(self, data, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        colecovision: bool = False) -> S8BL_IdentifyResult:
+        variants = crc32_variants_for(data, colecovision, chunk_size)
+        result = self.match_crc32_variants(variants)
+        if result.found:
+            return result
+
+        crc = variants[0]
+        size, ocrc = overdump_crc32(data)
+        if size < memoryview(data).nbytes:
+            entry = self.CRC_to_db.get(ocrc)
+            if entry is not None:
+                return S8BL_IdentifyResult(entry, S8BL_MatchRule['crc32_overdump'], ocrc)
+
+        # Fall back to the keys MEKA computes after preprocessing
+        ncrc, mcrc = rom_keys(data, colecovision, chunk_size)
+        if ncrc not in variants:
+            entry = self.CRC_to_db.get(ncrc)
+            if entry is not None:
+                return S8BL_IdentifyResult(entry, S8BL_MatchRule['crc32_normalized'], ncrc, mcrc)
+        if self.match_mekacrc:
+            entry = self.find_by_MekaCRC(mcrc)
+            if entry is not None:
+                return S8BL_IdentifyResult(entry, S8BL_MatchRule['mekacrc'], crc, mcrc)
+        return S8BL_IdentifyResult(None, S8BL_MatchRule['none'], crc, mcrc)
+
+    def identify_variants(self, source: RomSource, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                          colecovision: Optional[bool] = None) -> S8BL_IdentifyResult:
+        # Full, header-stripped and footer-stripped CRC32 from a single streaming read, no MEKA fallback
+        if colecovision is None:
+            colecovision = not is_buffer(source) and os.fspath(source).lower().endswith('.col')
+        return self.match_crc32_variants(crc32_variants_for(source, colecovision, chunk_size))
+
+    def match_crc32_variants(self, variants) -> S8BL_IdentifyResult:
+        # variants as returned by crc32_variants, tried in S8BL_VariantRules order
+        for rule, crc in zip(S8BL_VariantRules, variants):
+            if crc is None:
+                continue
+            entry = self.CRC_to_db.get(crc)
+            if entry is not None:
+                return S8BL_IdentifyResult(entry, rule, crc)
+        return S8BL_IdentifyResult(None, S8BL_MatchRule['none'], variants[0])
+
+    def load(self, path: str, lazy: bool = False, snapshot: bool = False) -> None:
+        # lazy only indexes CRC32 -> raw dict, entries are built when they are first looked up.
+        # snapshot keeps a marshalled copy of the decoded library next to path and reuses it while path is unchanged
         if not os.path.isfile(path):
             raise FileNotFoundError
-        with open(path, 'r') as infile:
+        key = None
+        if snapshot:
+            key = snapshot_key(path)
+            if self.load_snapshot(snapshot_path(path), key):
+                return
+        with open_profile(path, detect_profile(path), 'r') as infile:
             indata = json.load(infile)
-        self.fromPyDictTotal(indata)
+        if lazy and not snapshot:
+            self.fromPyDictLazy(indata)
+        else:
+            self.fromPyDictTotal(indata)
+        if snapshot:
+            try:
+                self.save_snapshot(snapshot_path(path), key)
+            except OSError:
+                # Only a cache, a read-only or full disk just means decoding path again next time
+                pass
+
+    def load_snapshot(self, spath: str, key) -> bool:
+        # Only acyclic objects are created while restoring, collector passes over them are pure overhead
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._restore_snapshot(spath, key)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _restore_snapshot(self, spath: str, key) -> bool:
+        # Rebuilds db and every index from marshalled member rows, no JSON decoding
+        if not os.path.isfile(spath):
+            return False
+        try:
+            with open(spath, 'rb') as infile:
+                snap = marshal.loads(infile.read())
+            version, skey, members, flag_members, rows, crcs, mekacrcs, names, products, postings = snap
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if version != SNAPSHOT_VERSION or skey != tuple(key) or members != snapshot_members() \
+                or flag_members != S8BL_Flag_Names:
+            return False
+        db = []
+        for values, flag_masks in rows:
+            entry = S8BL_LibraryEntry()
+            for member, value in values:
+                setattr(entry, member, value)
+            flags = entry.flags
+            flags.known, flags.value = flag_masks
+            db.append(entry)
+        self.db = db
+        self.CRC_to_db = {crc: db[pos] for crc, pos in crcs}
+        self.MekaCRC_to_db = {k: [db[pos] for pos in bucket] for k, bucket in mekacrcs}
+        self.name_to_db = {k: [db[pos] for pos in bucket] for k, bucket in names}
+        self.product_to_db = {k: [db[pos] for pos in bucket] for k, bucket in products}
+        self.system_to_db, self.mapper_to_db, self.country_to_db, self.flag_to_db = (
+            {k: {db[pos] for pos in bucket} for k, bucket in index} for index in postings)
+        self.db_pos = {entry: pos for pos, entry in enumerate(db)}
+        self.indexed = True
+        self.columns_cache = None
+        self.name_search = None
+        self.title_to_db = None
+        self.valid = True
+        return True
+
+    def save_snapshot(self, spath: str, key) -> None:
+        members = snapshot_members()
+        pos = self.db_pos
+
+        def positions(index):
+            return [(k, [pos[entry] for entry in bucket]) for k, bucket in index.items()]
+
+        def present(obj, names):
+            # Rows only carry the members that are set, most of them are None
+            return tuple((nm, getattr(obj, nm)) for nm in names if getattr(obj, nm) is not None)
+
+        rows = [(present(entry, members), (entry.flags.known, entry.flags.value)) for entry in self.db]
+        snap = (SNAPSHOT_VERSION, tuple(key), members, S8BL_Flag_Names, rows,
+                [(crc, pos[entry]) for crc, entry in self.CRC_to_db.items()],
+                positions(self.MekaCRC_to_db), positions(self.name_to_db), positions(self.product_to_db),
+                [positions(index) for index in (self.system_to_db, self.mapper_to_db, self.country_to_db,
+                                                self.flag_to_db)])
+        tpath = spath + '.tmp'
+        with open(tpath, 'wb') as outfile:
+            marshal.dump(snap, outfile)
+        os.replace(tpath, spath)
+
+    def fromPyDictLazy(self, indata: List) -> None:
+        self.db = S8BL_LazyEntryList(indata)
+        self.CRC_to_db = S8BL_LazyCRCIndex(self.db)
+        for pos, raw in enumerate(indata):
+            if raw['CRC32'] != 0:
+                self.CRC_to_db.set_position(raw['CRC32'], pos)
+        self.indexed = False
+        self.columns_cache = None
+        self.name_search = None
+        self.title_to_db = None
+        self.valid = True
 
     def fromPyDictTotal(self, indata: List) -> None:
         self.db = []
         for entry in indata:
             dbitem = S8BL_LibraryEntry()
             dbitem.fromPyObjectTotal(entry)
-            self.CRC_to_db[dbitem.CRC32] = dbitem
+            # CRC 0 means no CRC known (MekaCRC-only entries), never a key: an empty ROM hashes to 0
+            if dbitem.CRC32 != 0:
+                self.CRC_to_db[dbitem.CRC32] = dbitem
             self.db.append(dbitem)
+        self.reindex()
         self.valid = True
 
     def toPyDict(self):
@@ -344,13 +1274,40 @@ class S8BL_Library:
             out.append(item.toPyDict())
         return out
 
-    def save(self, path: str) -> None:
+    def save(self, path: str, profile: str = 'pretty') -> None:
         tpath = path + '.tmp'
         if os.path.isfile(tpath):
             os.unlink(tpath)
-        mydata = self.toPyDict()
-        with open(tpath, 'w') as outfile:
-            json.dump(mydata, outfile, indent=2)
+        with open_profile(tpath, profile, 'w') as outfile:
+            if profile == 'pretty':
+                self.write_json(outfile)
+            else:
+                self.write_json_compact(outfile)
         if os.path.isfile(path):
             os.unlink(path)
         os.rename(tpath, path)
+
+    def write_json(self, outfile, buffer_size: int = 4096) -> None:
+        # Streams one entry at a time, byte for byte what json.dump(self.toPyDict(), indent=2) writes
+        parts = []
+        for part in json.JSONEncoder(indent=2).iterencode(S8BL_PyDictStream(self.db)):
+            parts.append(part)
+            if len(parts) >= buffer_size:
+                outfile.write(''.join(parts))
+                parts = []
+        outfile.write(''.join(parts))
+
+    def write_json_compact(self, outfile, buffer_size: int = 256) -> None:
+        # Same as json.dump(self.toPyDict(), separators=(',', ':')), entries go through the C encoder one by one
+        encoder = json.JSONEncoder(separators=(',', ':'))
+        parts = []
+        outfile.write('[')
+        for i, item in enumerate(self.db):
+            if i > 0:
+                parts.append(',')
+            parts.append(encoder.encode(item.toPyDict()))
+            if len(parts) >= buffer_size:
+                outfile.write(''.join(parts))
+                parts = []
+        parts.append(']')
+        outfile.write(''.join(parts))
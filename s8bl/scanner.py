@@ -0,0 +1,397 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple, Iterator
+
+from s8bl.romhash import DEFAULT_CHUNK_SIZE, ROM_SIZE_GRANULARITY, crc32_variants_for, mapped_rom, rom_keys
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, S8BL_IdentifyResult, S8BL_MatchRule
+
+ROM_EXTENSIONS = ('.sms', '.gg', '.sg', '.sc', '.zip')
+ZIP_EXTENSION = '.zip'
+# Overdumps MEKA knows to strip, as multiples of the real ROM size
+OVERDUMP_FACTORS = (2, 3, 4)
+
+
+class S8BL_ScanReport:
+    def __init__(self):
+        # (CRC32, MekaCRC) of the matched entry -> paths of every file that matched it. CRC32 alone
+        # is 0 for every MekaCRC-only entry
+        self.have: Dict[Tuple[int, Optional[str]], List[str]] = {}
+        self.entries: Dict[Tuple[int, Optional[str]], S8BL_LibraryEntry] = {}
+        # (path, CRC32) of files not in the library
+        self.unknown: List[Tuple[str, int]] = []
+        # (path, error) of files that could not be read
+        self.errors: List[Tuple[str, str]] = []
+        self.files: int = 0
+        self.bytes: int = 0
+        self.elapsed: float = 0.0
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+
+    @property
+    def mb_per_s(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / (1024 * 1024) / self.elapsed
+
+    @property
+    def files_per_s(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.files / self.elapsed
+
+    @property
+    def cache_hit_rate(self) -> float:
+        total = self.cache_hits + self.cache_misses
+        if total == 0:
+            return 0.0
+        return self.cache_hits / total
+
+    def summary(self) -> str:
+        return '%d files, %d known, %d unknown, %d errors in %.2fs (%.1f MB/s, %.0f files/s, %.0f%% cached)' % (
+            self.files, sum(len(p) for p in self.have.values()), len(self.unknown), len(self.errors),
+            self.elapsed, self.mb_per_s, self.files_per_s, self.cache_hit_rate * 100)
+
+
+class S8BL_ScanRecord:
+    # One ROM found by the scanner, a plain file or a zip member
+    def __init__(self, path: str, crcs: tuple = (None, None, None), size: int = 0, error: Optional[str] = None):
+        self.path: str = path
+        # (full, header stripped, footer stripped) CRC32, see romhash.crc32_variants
+        self.crcs: tuple = crcs
+        self.size: int = size
+        self.error: Optional[str] = error
+        # Only filled in once MEKA preprocessing had to run
+        self.CRC32_normalized: Optional[int] = None
+        self.MekaCRC: Optional[str] = None
+        self.SHA1: Optional[str] = None
+
+    @property
+    def CRC32(self) -> Optional[int]:
+        return self.crcs[0]
+
+
+def walk_roms(top: str, extensions=ROM_EXTENSIONS, unlisted: Optional[List[str]] = None) \
+        -> Iterator[Tuple[str, os.stat_result]]:
+    # Yields (path, stat). scandir hands back the stat info the walk needs without extra syscalls.
+    # OSError is raised if top itself cannot be listed, subdirectories that cannot are skipped
+    # and appended to unlisted
+    stack = [top]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                for dirent in it:
+                    if dirent.is_dir(follow_symlinks=False):
+                        stack.append(dirent.path)
+                    elif dirent.name.lower().endswith(extensions) and dirent.is_file():
+                        yield dirent.path, dirent.stat()
+        except OSError:
+            if path == top:
+                raise
+            if unlisted is not None:
+                unlisted.append(path)
+
+
+def zip_members(path: str) -> List[Tuple[str, int, int]]:
+    # (member name, CRC32, uncompressed size) straight from the central directory, nothing is inflated
+    with zipfile.ZipFile(path) as zf:
+        return [(info.filename, info.CRC, info.file_size) for info in zf.infolist() if not info.is_dir()]
+
+
+def read_zip_member(path: str, name: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bytearray:
+    # Streamed into a single preallocated buffer
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name)
+        buf = bytearray(info.file_size)
+        mv = memoryview(buf)
+        pos = 0
+        with zf.open(info) as member:
+            while pos < len(buf):
+                n = member.readinto(mv[pos:pos + chunk_size])
+                if not n:
+                    break
+                pos += n
+    return buf
+
+
+def needs_normalization(size: int, rom_sizes=()) -> bool:
+    # Only headered/footered or overdumped images hash differently once MEKA preprocessing is applied
+    if size % ROM_SIZE_GRANULARITY != 0:
+        return True
+    for factor in OVERDUMP_FACTORS:
+        if size % factor == 0 and size // factor in rom_sizes:
+            return True
+    return False
+
+
+def identify_zip_member(lib: S8BL_Library, path: str, name: str, crc: int, size: int, rom_sizes=(),
+                        chunk_size: int = DEFAULT_CHUNK_SIZE, every_miss: bool = False) -> S8BL_IdentifyResult:
+    entry = lib.CRC_to_db.get(crc)
+    if entry is not None:
+        return S8BL_IdentifyResult(entry, S8BL_MatchRule['crc32_zip_directory'], crc)
+    if not every_miss and not needs_normalization(size, rom_sizes):
+        return S8BL_IdentifyResult(None, S8BL_MatchRule['none'], crc)
+    return lib.identify(read_zip_member(path, name, chunk_size), chunk_size,
+                        colecovision=name.lower().endswith('.col'))
+
+
+def identify_zip(lib: S8BL_Library, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) \
+        -> List[Tuple[str, S8BL_IdentifyResult]]:
+    rom_sizes = lib_rom_sizes(lib)
+    every_miss = retries_every_miss(lib)
+    return [(name, identify_zip_member(lib, path, name, crc, size, rom_sizes, chunk_size, every_miss))
+            for name, crc, size in zip_members(path)]
+
+
+def lib_rom_sizes(lib: S8BL_Library) -> set:
+    return {entry.ROM_size for entry in lib.db if entry.ROM_size}
+
+
+def retries_every_miss(lib: S8BL_Library) -> bool:
+    # Entries known by MekaCRC only can match a clean ROM of any size, but only once that match is enabled
+    return lib.match_mekacrc and any(entry.CRC32 == 0 and entry.MekaCRC is not None for entry in lib.db)
+
+
+def hash_rom(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, sha1: bool = False) -> List[S8BL_ScanRecord]:
+    # Module level so it can be pickled for the process pool. Returns one record per member for zip archives.
+    # Plain files get the full, header-stripped and footer-stripped CRC32 (and SHA1) from a single read
+    try:
+        if path.lower().endswith(ZIP_EXTENSION):
+            return [S8BL_ScanRecord(path + '/' + name, (crc, None, None), size) for name, crc, size in zip_members(path)]
+        digests = [hashlib.sha1()] if sha1 else []
+        record = S8BL_ScanRecord(path, crc32_variants_for(path, path.lower().endswith('.col'), chunk_size, digests),
+                                 os.path.getsize(path))
+        if sha1:
+            record.SHA1 = digests[0].hexdigest()
+        return [record]
+    except (OSError, zipfile.BadZipFile) as e:
+        return [S8BL_ScanRecord(path, error=str(e))]
+
+
+def normalize_record(archive: str, record: S8BL_ScanRecord, chunk_size: int = DEFAULT_CHUNK_SIZE) -> S8BL_ScanRecord:
+    # Fills in the MEKA preprocessed keys, inflating the member for zip archives
+    try:
+        colecovision = record.path.lower().endswith('.col')
+        if record.path == archive:
+            with mapped_rom(archive) as mv:
+                record.CRC32_normalized, record.MekaCRC = rom_keys(mv, colecovision, chunk_size)
+        else:
+            data = read_zip_member(archive, record.path[len(archive) + 1:], chunk_size)
+            record.CRC32_normalized, record.MekaCRC = rom_keys(data, colecovision, chunk_size)
+    except (OSError, zipfile.BadZipFile) as e:
+        record.error = str(e)
+    return record
+
+
+def default_cache_path(db_path: str) -> str:
+    # Kept next to the JSON database, s8bl.json -> s8bl.scancache.sqlite
+    return os.path.splitext(db_path)[0] + '.scancache.sqlite'
+
+
+class S8BL_ScanCache:
+    # Persistent (path, size, mtime, inode) -> scan records map, so unchanged files are not hashed again
+    def __init__(self, path: str):
+        self.path: str = path
+        self.hits: int = 0
+        self.misses: int = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files '
+                          '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS roms '
+                          '(path TEXT, rom_path TEXT, crc32 INTEGER, crc32_no_header INTEGER, '
+                          'crc32_no_footer INTEGER, rom_size INTEGER, crc32_normalized INTEGER, mekacrc TEXT, '
+                          'sha1 TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS roms_path ON roms (path)')
+        self.conn.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def lookup(self, path: str, st: os.stat_result, sha1: bool = False) -> Optional[List[S8BL_ScanRecord]]:
+        # With sha1, plain files cached by a scan that did not hash them are misses (zip members never have one)
+        row = self.conn.execute('SELECT size, mtime_ns, inode FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None or row != (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.misses += 1
+            return None
+        records = []
+        for rom_path, crc, nh, nf, size, ncrc, mcrc, digest in self.conn.execute(
+                'SELECT rom_path, crc32, crc32_no_header, crc32_no_footer, rom_size, crc32_normalized, mekacrc, sha1 '
+                'FROM roms WHERE path = ?', (path,)):
+            record = S8BL_ScanRecord(rom_path, (crc, nh, nf), size)
+            record.CRC32_normalized = ncrc
+            record.MekaCRC = mcrc
+            record.SHA1 = digest
+            records.append(record)
+        if sha1 and any(record.path == path and record.SHA1 is None for record in records):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return records
+
+    def store(self, path: str, st: os.stat_result, records: List[S8BL_ScanRecord]) -> None:
+        # Unreadable files are not cached, they are retried on the next scan
+        if any(record.error is not None for record in records):
+            return
+        self.conn.execute('DELETE FROM roms WHERE path = ?', (path,))
+        self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                          (path, st.st_size, st.st_mtime_ns, st.st_ino))
+        self.conn.executemany('INSERT INTO roms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              [(path, r.path, r.crcs[0], r.crcs[1], r.crcs[2], r.size, r.CRC32_normalized,
+                                r.MekaCRC, r.SHA1) for r in records])
+
+    def evict(self, paths) -> int:
+        paths = [(path,) for path in paths]
+        self.conn.executemany('DELETE FROM files WHERE path = ?', paths)
+        self.conn.executemany('DELETE FROM roms WHERE path = ?', paths)
+        return len(paths)
+
+    def evict_unseen(self, top: str, seen, unlisted=()) -> int:
+        # Drops cached files under top that the last walk did not find, except under the unlisted directories
+        prefix = os.path.join(top, '')
+        keep = tuple(os.path.join(path, '') for path in unlisted)
+        stale = [path for (path,) in self.conn.execute('SELECT path FROM files')
+                 if path.startswith(prefix) and path not in seen and not path.startswith(keep)]
+        return self.evict(stale)
+
+    def prune(self) -> int:
+        # Drops every cached file that no longer exists
+        return self.evict([path for (path,) in self.conn.execute('SELECT path FROM files')
+                           if not os.path.isfile(path)])
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+class S8BL_Scanner:
+    def __init__(self, lib: S8BL_Library, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 use_processes: bool = False, extensions=ROM_EXTENSIONS, cache: Optional[S8BL_ScanCache] = None,
+                 sha1: bool = False):
+        self.lib: S8BL_Library = lib
+        # zlib.crc32 drops the GIL on large buffers, so threads scale well and are the default
+        self.workers: int = workers if workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        self.chunk_size: int = chunk_size
+        self.use_processes: bool = use_processes
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.cache: Optional[S8BL_ScanCache] = cache
+        self.sha1: bool = sha1
+
+    def _executor(self):
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def _chunksize(self, count: int) -> int:
+        if not self.use_processes:
+            return 1
+        return max(1, count // (self.workers * 4))
+
+    def scan(self, *tops: str) -> S8BL_ScanReport:
+        report = S8BL_ScanReport()
+        start = time.perf_counter()
+        files = []
+        unlisted = []
+        for top in tops:
+            for path, st in walk_roms(top, self.extensions, unlisted):
+                files.append((path, st))
+                report.bytes += st.st_size
+
+        records: Dict[str, List[S8BL_ScanRecord]] = {}
+        todo = []
+        for path, st in files:
+            cached = self.cache.lookup(path, st, self.sha1) if self.cache is not None else None
+            if cached is None:
+                todo.append(path)
+            else:
+                records[path] = cached
+
+        rom_sizes = lib_rom_sizes(self.lib)
+        every_miss = retries_every_miss(self.lib)
+        retry = []
+        with self._executor() as pool:
+            n = len(todo)
+            for path, recs in zip(todo, pool.map(hash_rom, todo, [self.chunk_size] * n, [self.sha1] * n,
+                                                 chunksize=self._chunksize(n))):
+                records[path] = recs
+            for path, st in files:
+                for record in records[path]:
+                    if self._needs_retry(path, record, rom_sizes, every_miss):
+                        retry.append((path, record))
+            if len(retry) > 0:
+                # Overdumps and headered images need the full MEKA preprocessing
+                n = len(retry)
+                done = pool.map(normalize_record, [a for a, r in retry], [r for a, r in retry],
+                                [self.chunk_size] * n, chunksize=self._chunksize(n))
+                # Process pools hand back copies
+                fixed = {(a, r.path): d for (a, r), d in zip(retry, done)}
+                for path in records:
+                    records[path] = [fixed.get((path, r.path), r) for r in records[path]]
+
+        # Cache hits are only written back when the retry added keys to them
+        changed = set(todo)
+        changed.update(path for path, record in retry)
+
+        for path, st in files:
+            for record in records[path]:
+                if path != record.path and not record.path.lower().endswith(self.extensions):
+                    # zip member that is not a ROM
+                    continue
+                self._add(report, record)
+            if self.cache is not None and path in changed:
+                self.cache.store(path, st, records[path])
+
+        if self.cache is not None:
+            seen = set(path for path, st in files)
+            for top in tops:
+                self.cache.evict_unseen(top, seen, unlisted)
+            self.cache.commit()
+            report.cache_hits = len(files) - len(todo)
+            report.cache_misses = len(todo)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _needs_retry(self, archive: str, record: S8BL_ScanRecord, rom_sizes, every_miss: bool) -> bool:
+        if record.error is not None or record.MekaCRC is not None:
+            return False
+        if archive != record.path and not record.path.lower().endswith(self.extensions):
+            return False
+        if self.lib.match_crc32_variants(record.crcs).found:
+            return False
+        return every_miss or needs_normalization(record.size, rom_sizes)
+
+    def resolve(self, record: S8BL_ScanRecord) -> Optional[S8BL_LibraryEntry]:
+        # Straight CRC_to_db / MekaCRC_to_db lookups, nothing is read from disk
+        entry = self.lib.match_crc32_variants(record.crcs).entry
+        if entry is None and record.CRC32_normalized is not None:
+            entry = self.lib.CRC_to_db.get(record.CRC32_normalized)
+        if entry is None and record.MekaCRC is not None and self.lib.match_mekacrc:
+            entry = self.lib.find_by_MekaCRC(record.MekaCRC)
+        return entry
+
+    def _add(self, report: S8BL_ScanReport, record: S8BL_ScanRecord) -> None:
+        report.files += 1
+        if record.error is not None:
+            report.errors.append((record.path, record.error))
+            return
+        entry = self.resolve(record)
+        if entry is None:
+            report.unknown.append((record.path, record.CRC32))
+            return
+        key = (entry.CRC32, entry.MekaCRC)
+        report.have.setdefault(key, []).append(record.path)
+        report.entries[key] = entry
+
+
+def scan(lib: S8BL_Library, *tops: str, **kwargs) -> S8BL_ScanReport:
+    return S8BL_Scanner(lib, **kwargs).scan(*tops)
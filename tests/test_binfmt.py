@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from s8bl.binfmt import countries_from_mask, countries_mask, open_binary, save_binary
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MERGED_DB = os.path.join(ROOT, 's8bl2_meka_totalsms.json')
+
+
+def codes(countries):
+    return {code.strip() for c in countries or [] for code in c.split(',')}
+
+
+def test_countries_mask_keeps_every_country():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    for entry in lib.db:
+        assert codes(countries_from_mask(countries_mask(entry))) == codes(entry.countries), entry.names
+
+
+def test_countries_mask_rejects_unknown_codes():
+    entry = S8BL_LibraryEntry()
+    entry.names = ['Test']
+    entry.countries = ['JP,XX']
+    with pytest.raises(ValueError):
+        countries_mask(entry)
+
+
+def test_binary_keeps_known_clear_flags(tmp_path):
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    entry = next(e for e in lib.db if e.CRC32 != 0)
+    entry.flags.bad = False
+    entry.flags.prototype = True
+    path = str(tmp_path / 'flags.s8bl')
+    save_binary(lib, path)
+    with open_binary(path) as blib:
+        flags = blib.get(entry.CRC32).flags
+        assert flags.bad is False
+        assert flags.prototype is True
+        assert flags.known == entry.flags.known and flags.value == entry.flags.value
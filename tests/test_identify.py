@@ -0,0 +1,83 @@
+import os
+import random
+
+from s8bl.binfmt import save_binary, open_binary
+from s8bl.romhash import rom_keys
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry
+from s8bl.scanner import scan
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MERGED_DB = os.path.join(ROOT, 's8bl2_meka_totalsms.json')
+
+
+def merged_library(**kwargs) -> S8BL_Library:
+    lib = S8BL_Library()
+    lib.load(MERGED_DB, **kwargs)
+    return lib
+
+
+def test_crcless_entries_are_not_indexed_under_zero():
+    lib = merged_library()
+    assert any(e.CRC32 == 0 for e in lib.db)
+    assert 0 not in lib.CRC_to_db
+    assert 0 not in merged_library(lazy=True).CRC_to_db
+
+
+def test_empty_buffer_is_unknown():
+    result = merged_library().identify(b'')
+    assert not result.found
+    assert result.entry is None
+
+
+def test_empty_file_is_unknown(tmp_path):
+    lib = merged_library()
+    path = tmp_path / 'empty.sms'
+    path.write_bytes(b'')
+    assert not lib.identify(str(path)).found
+    report = scan(lib, str(tmp_path))
+    assert report.have == {}
+    assert report.unknown == [(str(path), 0)]
+
+
+def test_binary_library_ignores_crc_zero(tmp_path):
+    path = str(tmp_path / 'merged.s8bl')
+    save_binary(merged_library(), path)
+    with open_binary(path) as blib:
+        assert blib.get(0) is None
+        assert 0 not in blib
+
+
+def test_scan_matches_mekacrc_only_entries(tmp_path):
+    # Clean ROMs whose CRC32s are unknown, known to the library by MekaCRC only
+    lib = merged_library()
+    lib.match_mekacrc = True
+    expected = {}
+    for i in range(2):
+        data = random.Random(i).randbytes(5 * 1024)
+        entry = S8BL_LibraryEntry()
+        entry.names = ['MekaCRC only %d' % i]
+        entry.MekaCRC = rom_keys(data)[1]
+        lib.merge_in(entry)
+        path = tmp_path / ('clean%d.sms' % i)
+        path.write_bytes(data)
+        assert lib.identify(str(path)).entry is entry
+        expected[(0, entry.MekaCRC)] = (entry, [str(path)])
+    report = scan(lib, str(tmp_path))
+    assert report.unknown == []
+    assert {key: (report.entries[key], paths) for key, paths in report.have.items()} == expected
+
+
+def test_unverified_mekacrc_is_not_matched_by_default(tmp_path):
+    lib = merged_library()
+    assert not lib.match_mekacrc
+    data = random.Random(0).randbytes(5 * 1024)
+    entry = S8BL_LibraryEntry()
+    entry.names = ['MekaCRC only']
+    entry.MekaCRC = rom_keys(data)[1]
+    lib.merge_in(entry)
+    path = tmp_path / 'clean.sms'
+    path.write_bytes(data)
+    assert not lib.identify(str(path)).found
+    report = scan(lib, str(tmp_path))
+    assert report.have == {}
+    assert report.unknown == [(str(path), rom_keys(data)[0])]
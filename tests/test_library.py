@@ -0,0 +1,106 @@
+import os
+import shutil
+
+import dump_Meka
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry, snapshot_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MERGED_DB = os.path.join(ROOT, 's8bl2_meka_totalsms.json')
+
+
+def test_load_survives_snapshot_write_failure(tmp_path):
+    path = str(tmp_path / 'merged.json')
+    shutil.copyfile(MERGED_DB, path)
+    # The snapshot is written through <snapshot>.tmp, a directory there makes the write fail
+    os.mkdir(snapshot_path(path) + '.tmp')
+    lib = S8BL_Library()
+    lib.load(path, snapshot=True)
+    expected = S8BL_Library()
+    expected.load(MERGED_DB)
+    assert lib.toPyDict() == expected.toPyDict()
+    assert not os.path.exists(snapshot_path(path))
+
+
+def test_lazy_db_never_hands_out_raw_dicts():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB, lazy=True)
+    db = lib.db
+    n = len(db)
+    assert all(type(entry) is S8BL_LibraryEntry for entry in db[2:6])
+    assert type(next(reversed(db))) is S8BL_LibraryEntry
+    assert type(db[-2]) is S8BL_LibraryEntry
+    assert type(db.pop()) is S8BL_LibraryEntry
+    assert len(db) == n - 1
+    copy = db.copy()
+    assert type(copy) is list and len(copy) == n - 1
+    assert all(type(entry) is S8BL_LibraryEntry for entry in copy)
+    assert db.materialized == n - 1
+
+
+def test_flags_known_clear_are_not_saved_as_set(tmp_path):
+    lib = S8BL_Library()
+    lib.load(MERGED_DB)
+    entry = lib.db[0]
+    entry.flags.bad = False
+    entry.flags.prototype = True
+    path = str(tmp_path / 'flags.json')
+    lib.save(path)
+    again = S8BL_Library()
+    again.load(path)
+    # JSON only holds set flags, a clear one comes back unknown
+    assert again.db[0].flags.bad is None
+    assert again.db[0].flags.prototype is True
+
+
+def test_lazy_crc_index_never_hands_out_positions():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB, lazy=True)
+    index = lib.CRC_to_db
+    for copy in (dict(index), {**index}, index.copy()):
+        assert all(type(entry) is S8BL_LibraryEntry for entry in copy.values())
+    crc = next(iter(index))
+    assert type(index.setdefault(crc, None)) is S8BL_LibraryEntry
+    assert type(index.pop(crc)) is S8BL_LibraryEntry
+
+
+def test_lazy_crc_index_follows_db_mutations():
+    lib = S8BL_Library()
+    lib.load(MERGED_DB, lazy=True)
+    eager = S8BL_Library()
+    eager.load(MERGED_DB)
+    crcs = [e.CRC32 for e in eager.db if e.CRC32 != 0 and eager.CRC_to_db[e.CRC32] is e]
+    del lib.db[0]
+    lib.db.insert(3, S8BL_LibraryEntry())
+    lib.db.reverse()
+    for crc in crcs[1:]:
+        assert lib.CRC_to_db[crc].toPyDict() == eager.CRC_to_db[crc].toPyDict()
+
+
+def test_merge_library_takes_parsed_meka_stream():
+    nam = os.path.join(ROOT, 'meka.nam')
+    streamed = S8BL_Library()
+    with dump_Meka.open_nam(nam) as infile:
+        streamed.merge_library(dump_Meka.parse_stream(infile))
+    expected = S8BL_Library()
+    for entry in dump_Meka.parse_file(nam):
+        expected.merge_in(entry)
+    assert len(streamed.db) > 0
+    assert streamed.toPyDict() == expected.toPyDict()
+
+
+def test_merge_library_does_not_share_entries_with_other():
+    other = S8BL_Library()
+    entry = S8BL_LibraryEntry()
+    entry.names = ['Alex Kidd']
+    entry.CRC32 = 0x12345678
+    other.merge_in(entry)
+    lib = S8BL_Library()
+    lib.merge_library(other)
+    again = S8BL_LibraryEntry()
+    again.names = ['Alex Kidd in Miracle World']
+    again.CRC32 = 0x12345678
+    again.flags.fromPyDict(['bad'])
+    lib.merge_in(again)
+    assert lib.CRC_to_db[0x12345678] is not entry
+    assert entry.names == ['Alex Kidd']
+    assert entry.flags.known == 0
@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import zlib
+
+import pytest
+
+import dump_Meka
+from s8bl.romhash import crc32_combine, meka_normalize, mekacrc, rom_keys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Directory of real ROM dumps to check the MEKA keys against meka.nam, none are shipped
+ROM_DIR = os.environ.get('S8BL_TEST_ROMS')
+
+
+def test_crc32_combine_from_many_threads():
+    # The zero-byte operators are shared by the scanner's threads
+    wrong = []
+
+    def work():
+        for i in range(100):
+            a = os.urandom(50)
+            b = os.urandom(1 + i * 37)
+            if crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)) != zlib.crc32(a + b):
+                wrong.append(i)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=work) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert wrong == []
+
+
+def test_rom_keys_single_pass_matches_separate_hashes():
+    # Lengths around the chunk size, with and without a copier header, plus an 8-byte tail
+    for size in (0, 7, 8, 1024, 4096 + 512, 3 * 1024 + 5):
+        data = os.urandom(size)
+        for chunk_size in (64, 1000, 1 << 18):
+            crc, mcrc = rom_keys(data, chunk_size=chunk_size)
+            assert crc == zlib.crc32(meka_normalize(data))
+            assert mcrc == mekacrc(data)
+
+
+@pytest.mark.skipif(not ROM_DIR, reason='S8BL_TEST_ROMS is not set')
+def test_mekacrc_matches_meka_nam():
+    known = {entry.CRC32: entry.MekaCRC for entry in dump_Meka.parse_file(os.path.join(ROOT, 'meka.nam'))
+             if entry.CRC32 != 0}
+    checked = 0
+    for dirpath, dirnames, filenames in os.walk(ROM_DIR):
+        for name in filenames:
+            if name.lower().endswith('.zip'):
+                continue
+            with open(os.path.join(dirpath, name), 'rb') as infile:
+                crc, mcrc = rom_keys(infile.read(), name.lower().endswith('.col'))
+            if crc in known:
+                assert mcrc == known[crc], name
+                checked += 1
+    if checked == 0:
+        pytest.skip('no dump in S8BL_TEST_ROMS is listed in meka.nam')
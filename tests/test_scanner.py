@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from s8bl import scanner as scanner_module
+from s8bl.s8bl import S8BL_Library, S8BL_LibraryEntry
+from s8bl.scanner import S8BL_ScanCache, S8BL_Scanner
+
+
+class CountingCache(S8BL_ScanCache):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.stored = []
+
+    def store(self, path, st, records):
+        self.stored.append(path)
+        super().store(path, st, records)
+
+
+def cached_paths(cache: S8BL_ScanCache):
+    return sorted(path for (path,) in cache.conn.execute('SELECT path FROM files'))
+
+
+def write_roms(top, *names):
+    os.makedirs(top, exist_ok=True)
+    paths = []
+    for i, name in enumerate(names):
+        path = os.path.join(top, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(bytes([i]) * 8192)
+        paths.append(path)
+    return paths
+
+
+def test_cache_hits_are_not_written_back(tmp_path):
+    top = str(tmp_path / 'roms')
+    a, b = write_roms(top, 'a.sms', 'b.sms')
+    cache = CountingCache(str(tmp_path / 'scan.sqlite'))
+    scanner = S8BL_Scanner(S8BL_Library(), workers=2, cache=cache)
+    scanner.scan(top)
+    assert sorted(cache.stored) == [a, b]
+
+    cache.stored = []
+    report = scanner.scan(top)
+    assert report.cache_hits == 2
+    assert cache.stored == []
+
+    with open(b, 'ab') as outfile:
+        outfile.write(b'\0' * 1024)
+    cache.stored = []
+    scanner.scan(top)
+    assert cache.stored == [b]
+    cache.close()
+
+
+def test_missing_root_raises_and_keeps_cache(tmp_path):
+    top = str(tmp_path / 'roms')
+    paths = write_roms(top, 'a.sms', 'b.sms')
+    cache = S8BL_ScanCache(str(tmp_path / 'scan.sqlite'))
+    scanner = S8BL_Scanner(S8BL_Library(), workers=2, cache=cache)
+    scanner.scan(top)
+    os.rename(top, str(tmp_path / 'unmounted'))
+    with pytest.raises(OSError):
+        scanner.scan(top)
+    assert cached_paths(cache) == sorted(paths)
+    cache.close()
+
+
+def test_evict_unseen_keeps_unlisted_directories(tmp_path):
+    top = str(tmp_path / 'roms')
+    kept = write_roms(os.path.join(top, 'locked'), 'a.sms')
+    write_roms(top, 'b.sms')
+    cache = S8BL_ScanCache(str(tmp_path / 'scan.sqlite'))
+    S8BL_Scanner(S8BL_Library(), workers=2, cache=cache).scan(top)
+    assert cache.evict_unseen(top, set(), [os.path.join(top, 'locked')]) == 1
+    assert cached_paths(cache) == kept
+    cache.close()
+
+
+def test_only_odd_sizes_are_normalized(tmp_path, monkeypatch):
+    top = str(tmp_path / 'roms')
+    write_roms(top, 'clean.sms')
+    headered = os.path.join(top, 'headered.sms')
+    with open(headered, 'wb') as outfile:
+        outfile.write(b'\xff' * (8192 + 512))
+    normalized = []
+    normalize_record = scanner_module.normalize_record
+
+    def counting(archive, record, chunk_size):
+        normalized.append(archive)
+        return normalize_record(archive, record, chunk_size)
+
+    monkeypatch.setattr(scanner_module, 'normalize_record', counting)
+    lib = S8BL_Library()
+    S8BL_Scanner(lib, workers=2).scan(top)
+    assert normalized == [headered]
+
+    # MekaCRC-only entries make every miss worth the MEKA keys, once they are matched at all
+    entry = S8BL_LibraryEntry()
+    entry.MekaCRC = '0123456789ABCDEF'
+    lib.merge_in(entry)
+    normalized.clear()
+    S8BL_Scanner(lib, workers=2).scan(top)
+    assert normalized == [headered]
+    lib.match_mekacrc = True
+    normalized.clear()
+    S8BL_Scanner(lib, workers=2).scan(top)
+    assert sorted(normalized) == sorted([os.path.join(top, 'clean.sms'), headered])
+
+
+def test_sha1_scan_rehashes_files_cached_without_sha1(tmp_path):
+    top = str(tmp_path / 'roms')
+    (a,) = write_roms(top, 'a.sms')
+    cache = CountingCache(str(tmp_path / 'scan.sqlite'))
+    S8BL_Scanner(S8BL_Library(), workers=2, cache=cache).scan(top)
+    cache.stored = []
+    report = S8BL_Scanner(S8BL_Library(), workers=2, cache=cache, sha1=True).scan(top)
+    assert report.cache_misses == 1
+    assert cache.stored == [a]
+    assert cache.lookup(a, os.stat(a), sha1=True)[0].SHA1 is not None
+    cache.close()